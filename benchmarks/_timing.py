@@ -0,0 +1,10 @@
+import time
+
+def timeit(func, repeat:int=3)->float:
+    # repeat 번 실행해서 가장 짧은 시간을 돌려준다
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
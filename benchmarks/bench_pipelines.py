@@ -0,0 +1,287 @@
+# packmol 후처리와 povray 렌더링 과정의 벤치마크 모음
+#
+#   python benchmarks/bench_pipelines.py                       # 10^3 ~ 10^5 원자, 모든 벤치마크
+#   python benchmarks/bench_pipelines.py --sizes 1000000 --only read_src position_smoothing custom_colors
+#   python benchmarks/bench_pipelines.py --save                # benchmarks/results/<commit>.json 에 저장
+#   python benchmarks/bench_pipelines.py --compare <commit>    # 저장된 결과보다 threshold 배 이상 느려지면 exit code 1
+#
+# packmol/povray 는 PATH/환경 변수를 임시 폴더의 가짜 실행 파일로 바꿔서 실행하므로 설치되어 있지 않아도 된다.
+# 가짜 packmol 은 분자를 box 안에 무작위로 놓기만 하고, 가짜 povray 는 ini 크기의 빈 PNG 만 만든다.
+import sys, os, json, time, stat, argparse, platform, subprocess, tempfile
+# 다른 폴더에서 실행해도 같은 폴더의 bench_xyz, bench_povray_utils 를 import 할 수 있게 한다
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import numpy as np
+import yaml
+from ase import Atoms
+from ase.build import bulk, molecule
+from ase.io import write
+from _timing import timeit
+from bench_xyz import make_packmol_box
+from bench_povray_utils import make_slab
+from ccelkit.packmol import make_system
+from ccelkit.packmol._packmol_utils import read_src
+from ccelkit.packmol._packmol_overlap import filter_overlapping_molecules, get_molecule_overlaps
+from ccelkit.povray import render_atoms
+from ccelkit.povray._povray_utils import set_position_smoothing, set_custom_colors
+from ccelkit.povray._povray_scene import write_scene
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+DEFAULT_SIZES = [10**3, 10**4, 10**5]
+DEFAULT_THRESHOLD = 1.2
+# 물 분자 30 개 당 LiPF6 한 쌍 (약 1.8 M)
+WATER_PER_ION_PAIR = 30
+FLUID_ATOM_DENSITY = 0.1
+
+FAKE_PACKMOL = '''#!{python}
+import sys
+import numpy as np
+seed, output, structures = 0, None, []
+for line in sys.stdin.read().splitlines():
+    tokens = line.split()
+    if not tokens:
+        continue
+    if tokens[0] == 'seed':
+        seed = int(tokens[1])
+    elif tokens[0] == 'output':
+        output = tokens[1]
+    elif tokens[0] == 'structure':
+        structures.append({{'path': tokens[1], 'number': 1, 'box': None}})
+    elif tokens[0] == 'number':
+        structures[-1]['number'] = int(tokens[1])
+    elif tokens[0] == 'inside':
+        structures[-1]['box'] = [float(x) for x in tokens[2:8]]
+rng = np.random.default_rng(seed)
+symbols, positions = [], []
+for structure in structures:
+    with open(structure['path']) as f:
+        lines = f.read().splitlines()
+    mol = [line.split()[:4] for line in lines[2:2 + int(lines[0])]]
+    mol_positions = np.array([[float(x) for x in m[1:4]] for m in mol])
+    mol_positions -= mol_positions.mean(axis=0)
+    low, high = np.array(structure['box'][:3]), np.array(structure['box'][3:])
+    centers = low + rng.random((structure['number'], 3)) * (high - low)
+    symbols += [m[0] for m in mol] * structure['number']
+    positions.append((centers[:, None, :] + mol_positions[None, :, :]).reshape(-1, 3))
+positions = np.concatenate(positions) if positions else np.empty((0, 3))
+with open(output, 'w') as f:
+    f.write(f"{{len(symbols)}}\\nfake packmol\\n")
+    f.writelines(f"{{s}} {{x:.6f}} {{y:.6f}} {{z:.6f}}\\n" for s, (x, y, z) in zip(symbols, positions))
+print("Success!")
+'''
+
+FAKE_POVRAY = '''#!{python}
+import sys, os
+from PIL import Image
+width, height = 320, 240
+for ini in [arg for arg in sys.argv[1:] if arg.endswith('.ini')]:
+    for line in open(ini):
+        if line.startswith('Width='):
+            width = int(float(line.split('=')[1]))
+        if line.startswith('Height='):
+            height = int(float(line.split('=')[1]))
+pov = [arg for arg in sys.argv[1:] if arg.endswith('.pov')][0]
+Image.new('RGBA', (width, height), (255, 255, 255, 255)).save(os.path.splitext(pov)[0] + '.png')
+'''
+
+def install_fake_tools(bin_dir:str)->None:
+    # packmol 은 PACKMOL 환경 변수, povray 는 PATH 의 'povray' 와 POVRAY/include 로 찾는다
+    os.makedirs(os.path.join(bin_dir, 'povray_home', 'include'), exist_ok=True)
+    for name, script in [('packmol', FAKE_PACKMOL), ('povray', FAKE_POVRAY)]:
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(script.format(python=sys.executable))
+        os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ['PACKMOL'] = os.path.join(bin_dir, 'packmol')
+    os.environ['POVRAY'] = os.path.join(bin_dir, 'povray_home')
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    return None
+
+def get_box_length(num_atoms:int)->float:
+    return (num_atoms / FLUID_ATOM_DENSITY) ** (1/3)
+
+def make_pf6()->Atoms:
+    bond = 1.6
+    directions = [[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]]
+    return Atoms('PF6', positions=[[0, 0, 0]] + [[bond * x for x in d] for d in directions])
+
+def make_electrolyte_counts(num_atoms:int)->dict:
+    # 물 + LiPF6 전해질에서 원자 수가 num_atoms 에 가까운 분자 수
+    num_pairs = max(1, num_atoms // (3 * WATER_PER_ION_PAIR + 8))
+    return {'water': num_pairs * WATER_PER_ION_PAIR, 'Li': num_pairs, 'PF6': num_pairs}
+
+def make_mo_slab(num_atoms:int, length:float)->Atoms:
+    # length x length 면적의 bcc Mo(100) 판. 두께로 원자 수를 맞춘다
+    unit = bulk('Mo', 'bcc', a=3.147, cubic=True)
+    n_xy = max(1, int(length // 3.147))
+    n_z = max(1, int(np.ceil(num_atoms / (2 * n_xy * n_xy))))
+    slab = unit.repeat((n_xy, n_xy, n_z))
+    slab.positions[:, :2] *= length / (n_xy * 3.147)
+    return slab
+
+def write_src_dir(src_dir:str, num_atoms:int)->dict:
+    # num_atoms 개 원자의 전해질과 그 1/5 크기의 Mo 판을 make_system 의 src 구조로 쓴다
+    length = get_box_length(num_atoms)
+    fluid_dir = os.path.join(src_dir, 'fluid')
+    solid_dir = os.path.join(src_dir, 'solid')
+    os.makedirs(fluid_dir, exist_ok=True)
+    os.makedirs(solid_dir, exist_ok=True)
+    write(os.path.join(src_dir, 'cell_POSCAR'), Atoms('H', positions=[[0, 0, 0]], cell=[length] * 3, pbc=True))
+    write(os.path.join(fluid_dir, 'water.xyz'), molecule('H2O'))
+    write(os.path.join(fluid_dir, 'Li.xyz'), Atoms('Li', positions=[[0, 0, 0]]))
+    write(os.path.join(fluid_dir, 'PF6.xyz'), make_pf6())
+    write(os.path.join(solid_dir, 'Mo_slab_POSCAR'), make_mo_slab(num_atoms // 5, length))
+    return make_electrolyte_counts(num_atoms)
+
+def setup_read_src(num_atoms:int, work_dir:str):
+    src_dir = os.path.join(work_dir, 'src')
+    write_src_dir(src_dir, num_atoms)
+    return lambda: read_src(src_dir, use_cache=False)
+
+def setup_read_src_cached(num_atoms:int, work_dir:str):
+    src_dir = os.path.join(work_dir, 'src')
+    write_src_dir(src_dir, num_atoms)
+    read_src(src_dir, use_cache=True)
+    return lambda: read_src(src_dir, use_cache=True)
+
+def setup_fluid_overlap(num_atoms:int, work_dir:str):
+    # build_system 의 유체 중복 제거 (분자마다 검사 후 등록)
+    box = make_packmol_box(num_atoms)
+    cell = np.eye(3) * box.positions.max()
+    molecules = [list(range(start, start + 3)) for start in range(0, len(box), 3)]
+    return lambda: filter_overlapping_molecules(box.positions, cell, 2.0, molecules)
+
+def setup_solid_overlap(num_atoms:int, work_dir:str):
+    # build_system 의 고체-유체 중복 검사
+    box = make_packmol_box(num_atoms)
+    length = box.positions.max()
+    slab = make_mo_slab(num_atoms // 5, length)
+    cell = np.eye(3) * length
+    mol_ids = np.arange(len(box)) // 3
+    return lambda: get_molecule_overlaps(slab.positions, box.positions, cell, 3.0, mol_ids, len(box) // 3)
+
+def setup_make_system(num_atoms:int, work_dir:str):
+    root_dir = os.path.join(work_dir, 'system')
+    src_dir = os.path.join(root_dir, 'src')
+    counts = write_src_dir(src_dir, num_atoms)
+    config = {'src_dir': src_dir, 'out_dir': os.path.join(root_dir, 'out'),
+              'fluid': {name: {'type': 'number', 'value': count} for name, count in counts.items()},
+              'tolerance': 2.0, 'seed': 42, 'population': 1, 'solid_fluid_tolerance': 3.0,
+              'workers': 1, 'cache': True, 'packmol_retries': 0}
+    config_path = os.path.join(root_dir, 'config.yml')
+    with open(config_path, 'w') as f:
+        yaml.dump(config, f)
+    return lambda: make_system(config_path)
+
+def setup_position_smoothing(num_atoms:int, work_dir:str):
+    atoms = make_slab(num_atoms)
+    return lambda: set_position_smoothing(atoms)
+
+def setup_custom_colors(num_atoms:int, work_dir:str):
+    atoms = make_slab(num_atoms)
+    color_species = {'Mo': [0.580, 0, 0.827], 'S': [1.0, 1.0, 0.0]}
+    color_index = {0: [0.0, 0.0, 1.0], 1: [1.0, 0.0, 0.0]}
+    return lambda: set_custom_colors(atoms, {}, color_species, color_index)
+
+def setup_write_scene(num_atoms:int, work_dir:str):
+    # 매번 새 scene 폴더에 쓰므로 geometry/appearance include 를 항상 새로 쓴다
+    atoms = make_slab(num_atoms)
+    scratch_dir = os.path.join(work_dir, 'scratch')
+    os.makedirs(scratch_dir, exist_ok=True)
+    return lambda: write_scene(atoms, '-70x,-20y,0z', {'canvas_width': 1000}, scratch_dir, tempfile.mkdtemp(dir=work_dir), [])
+
+def setup_render_atoms(num_atoms:int, work_dir:str):
+    # ase 의 .pov 작성부터 PNG 읽기까지 (가짜 povray)
+    atoms = make_slab(num_atoms)
+    return lambda: render_atoms(atoms, 'perspective', canvas_width=400)
+
+BENCHMARKS = {
+    'read_src': setup_read_src,
+    'read_src_cached': setup_read_src_cached,
+    'fluid_overlap': setup_fluid_overlap,
+    'solid_overlap': setup_solid_overlap,
+    'make_system': setup_make_system,
+    'position_smoothing': setup_position_smoothing,
+    'custom_colors': setup_custom_colors,
+    'write_scene': setup_write_scene,
+    'render_atoms': setup_render_atoms,
+}
+
+def get_commit()->str:
+    # 결과 파일 이름. 커밋되지 않은 변경이 있으면 -dirty 를 붙인다
+    root_dir = os.path.dirname(RESULTS_DIR)
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root_dir, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root_dir, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return commit + '-dirty' if dirty else commit
+
+def load_results(reference:str)->dict:
+    # reference 는 결과 json 경로 또는 커밋 (results/<commit>.json)
+    path = reference if reference.endswith('.json') else os.path.join(RESULTS_DIR, f'{reference}.json')
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"벤치마크 결과 파일이 없습니다. ({path})")
+    with open(path) as f:
+        return json.load(f)
+
+def compare_results(reference:dict, timings:dict, threshold:float)->list:
+    # reference 보다 threshold 배 이상 느려진 (벤치마크, 원자 수) 목록
+    print(f"\n{reference['commit']} 와 비교")
+    print(f"{'benchmark':>20} {'atoms':>10} {'before':>10} {'after':>10} {'ratio':>7}")
+    regressions = []
+    for name, by_size in timings.items():
+        for size, seconds in by_size.items():
+            before = reference['timings'].get(name, {}).get(size)
+            if before is None:
+                continue
+            ratio = seconds / before
+            mark = ' 느려짐' if ratio > threshold else ''
+            print(f"{name:>20} {size:>10} {before:>9.3f}s {seconds:>9.3f}s {ratio:>6.2f}x{mark}")
+            if ratio > threshold:
+                regressions.append((name, size))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='packmol/povray 과정 벤치마크')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='원자 수')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=None, help='실행할 벤치마크')
+    parser.add_argument('--repeat', type=int, default=3, help='반복 횟수 (가장 짧은 시간을 기록)')
+    parser.add_argument('--save', action='store_true', help='results/<commit>.json 에 저장')
+    parser.add_argument('--compare', type=str, default=None, help='비교할 커밋 또는 결과 json')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='느려짐으로 판단하는 시간 비율')
+    args = parser.parse_args()
+
+    reference = load_results(args.compare) if args.compare else None
+    names = args.only or list(BENCHMARKS)
+    timings = {}
+    print(f"{'benchmark':>20} {'atoms':>10} {'time':>10}")
+    with tempfile.TemporaryDirectory(prefix='ccelkit_bench_') as tmp_dir:
+        install_fake_tools(os.path.join(tmp_dir, 'bin'))
+        os.environ['CCELKIT_CACHE_DIR'] = os.path.join(tmp_dir, 'render_cache')
+        for name in names:
+            timings[name] = {}
+            for num_atoms in args.sizes:
+                work_dir = tempfile.mkdtemp(prefix=f'{name}_{num_atoms}_', dir=tmp_dir)
+                func = BENCHMARKS[name](num_atoms, work_dir)
+                # json 의 key 는 문자열이므로 처음부터 문자열로 둔다
+                timings[name][str(num_atoms)] = timeit(func, args.repeat)
+                print(f"{name:>20} {num_atoms:>10} {timings[name][str(num_atoms)]:>9.3f}s")
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        commit = get_commit()
+        result = {'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                  'numpy': np.__version__, 'machine': platform.machine(), 'repeat': args.repeat, 'timings': timings}
+        result_path = os.path.join(RESULTS_DIR, f'{commit}.json')
+        with open(result_path, 'w') as f:
+            json.dump(result, f, indent=4)
+        print(f"저장: {result_path}")
+
+    if reference is not None:
+        regressions = compare_results(reference, timings, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}개의 벤치마크가 {args.threshold} 배 이상 느려졌습니다.")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
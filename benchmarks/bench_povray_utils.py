@@ -0,0 +1,62 @@
+import sys
+import numpy as np
+from ase import Atoms
+from ase.data.colors import jmol_colors
+from _timing import timeit
+from ccelkit.povray._povray_utils import set_position_smoothing, set_custom_colors
+
+def make_slab(num_atoms:int, seed:int=0)->Atoms:
+    # 기울어진 cell 의 Mo/S/O 무작위 구조
+    rng = np.random.default_rng(seed)
+    length = (num_atoms / 0.06) ** (1/3)
+    cell = np.array([[length, 0, 0], [0.3 * length, length, 0], [0, 0, length]])
+    scaled_positions = rng.random((num_atoms, 3)) * 1.02 - 0.01
+    symbols = rng.choice(['Mo', 'S', 'O'], num_atoms)
+    return Atoms(symbols=symbols, scaled_positions=scaled_positions, cell=cell, pbc=True)
+
+def legacy_position_smoothing(atoms:Atoms)->Atoms:
+    # 이전 구현 (원자마다 python loop)
+    atoms_copied = atoms.copy()
+    a, b, c = atoms_copied.get_cell()
+    positions = atoms_copied.get_positions()
+    limit_a, limit_b, limit_c = 0.99 * np.linalg.norm(a), 0.99 * np.linalg.norm(b), 0.99 * np.linalg.norm(c)
+    for i, pos in enumerate(positions):
+        if pos[0] > limit_a:
+            positions[i] -= a
+        if pos[1] > limit_b:
+            positions[i] -= b
+        if pos[2] > limit_c:
+            positions[i] -= c
+    atoms_copied.set_positions(positions)
+    return atoms_copied
+
+def legacy_custom_colors(atoms:Atoms, povray_settings:dict, color_species_dict:dict, color_index_dict:dict)->None:
+    # 이전 구현 (Atom 객체를 원자마다 생성)
+    colors = povray_settings.get('colors', [0.0 for _ in range(len(atoms))])
+    for i, atom in enumerate(atoms):
+        default_color = color_species_dict.get(atom.symbol, jmol_colors[atom.number])
+        colors[i] = color_index_dict.get(i, default_color)
+    povray_settings.update({'colors': colors})
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [10**4, 10**5, 10**6]
+    # 'mo' 처럼 원소 기호가 아닌 이름은 이전 구현과 같이 무시되어야 한다
+    color_species = {'Mo': [0.580, 0, 0.827], 'S': [1.0, 1.0, 0.0], 'mo': [0.0, 1.0, 0.0]}
+    color_index = {0: [0.0, 0.0, 1.0], 1: [1.0, 0.0, 0.0]}
+    print(f"{'atoms':>10} {'smoothing(old)':>15} {'smoothing':>10} {'colors(old)':>12} {'colors':>10}")
+    for num_atoms in sizes:
+        atoms = make_slab(num_atoms)
+        old_settings, new_settings = {}, {}
+        legacy_custom_colors(atoms, old_settings, color_species, color_index)
+        set_custom_colors(atoms, new_settings, color_species, color_index)
+        assert np.allclose(old_settings['colors'], new_settings['colors']), "이전 구현과 색이 다릅니다."
+        # 이전 구현은 느리므로 10^5 개를 넘으면 한 번만 잰다
+        repeat = 1 if num_atoms > 10**5 else 3
+        t_old_smoothing = timeit(lambda: legacy_position_smoothing(atoms), repeat)
+        t_smoothing = timeit(lambda: set_position_smoothing(atoms))
+        t_old_colors = timeit(lambda: legacy_custom_colors(atoms, {}, color_species, color_index), repeat)
+        t_colors = timeit(lambda: set_custom_colors(atoms, {}, color_species, color_index))
+        print(f"{num_atoms:>10} {t_old_smoothing:>14.3f}s {t_smoothing:>9.3f}s {t_old_colors:>11.3f}s {t_colors:>9.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import sys, os, tempfile
+import numpy as np
+from ase import Atoms
+from ase.io import read, write
+from _timing import timeit
+from ccelkit.packmol import read_xyz, write_xyz
+
+def make_packmol_box(num_atoms:int, seed:int=0)->Atoms:
+    # packmol 출력과 비슷한 물 box
+    rng = np.random.default_rng(seed)
+    num_molecules = num_atoms // 3
+    symbols = ['O', 'H', 'H'] * num_molecules
+    length = (num_molecules / 0.0334) ** (1/3)
+    positions = rng.random((3 * num_molecules, 3)) * length
+    return Atoms(symbols=symbols, positions=positions)
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [10**4, 10**5, 3*10**5]
+    print(f"{'atoms':>10} {'ase read':>10} {'read_xyz':>10} {'ase write':>10} {'write_xyz':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_atoms in sizes:
+            atoms = make_packmol_box(num_atoms)
+            xyz_path = os.path.join(tmp_dir, f'box_{num_atoms}.xyz')
+            write_xyz(xyz_path, atoms)
+
+            assert np.allclose(read_xyz(xyz_path).positions, read(xyz_path, format='xyz').positions)
+            t_ase_read = timeit(lambda: read(xyz_path, format='xyz'))
+            t_read = timeit(lambda: read_xyz(xyz_path))
+            t_ase_write = timeit(lambda: write(xyz_path, atoms, format='xyz'))
+            t_write = timeit(lambda: write_xyz(xyz_path, atoms))
+            print(f"{len(atoms):>10} {t_ase_read:>9.3f}s {t_read:>9.3f}s {t_ase_write:>9.3f}s {t_write:>9.3f}s")
+
+if __name__ == "__main__":
+    main()
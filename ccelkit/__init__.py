@@ -1,4 +1,4 @@
-from .povray import visual
+from .povray import visual, render_atoms, render_frames
 
 __version__ = "0.1"
 __author__ = "CCEL"
@@ -7,4 +7,6 @@ __email__ = "snupark@snu.ac.kr"
 # 사용자가 직접 접근할 수 있는 주요 함수/클래스들을 여기서 import
 __all__ = [
     "visual",
+    "render_atoms",
+    "render_frames",
 ]
\ No newline at end of file
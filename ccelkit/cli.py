@@ -20,21 +20,39 @@ def main():
     parser_visual.add_argument("-i","--input_filepath",type=str,default=None,help="input structure file path")
     parser_visual.add_argument("-o","--output_filepath",type=str,default=None,help="output image file path")
     parser_visual.add_argument("-r","--repeatation",type=int,nargs='+',default=[1,1,1],help="repeatation")
-    parser_visual.add_argument("-ori","--orientation",type=str,default="+0.955480 +0.294974 -0.006949 -0.042581 +0.161156 +0.986010 +0.291967 -0.941817 +0.166542",help="camera orientation")
+    parser_visual.add_argument("-ori","--orientation",type=str,nargs='+',default=["+0.955480 +0.294974 -0.006949 -0.042581 +0.161156 +0.986010 +0.291967 -0.941817 +0.166542"],help="camera orientation(s): preset names, or 9 numbers per matrix")
     parser_visual.add_argument("--cell_off",action='store_true',help="turn off cell")
     parser_visual.add_argument("-t","--transmittances",type=float,nargs='+',default=None,help="atom transmittances")
     parser_visual.add_argument("-H","--heatmaps",type=float,nargs='+',default=None,help="atom heatmaps")
+    parser_visual.add_argument("--heatmap_source",type=str,default=None,help="per frame heatmaps: .npy file (atoms or frames x atoms) or per-atom value in the trajectory (forces, charges, magmoms, ...)")
+    parser_visual.add_argument("--transmittance_source",type=str,default=None,help="per frame transmittances, same form as --heatmap_source")
+    parser_visual.add_argument("--colormap",type=str,default="redblue",help="heatmap colormap: redblue or a matplotlib colormap name")
+    parser_visual.add_argument("--heatmap_range",type=float,nargs=2,default=None,help="values mapped to the two ends of the colormap (default: 0 1)")
     parser_visual.add_argument("-w","--canvas_width",type=int,default=960,help="pixel of width")
     parser_visual.add_argument("-cs","--color_species",type=dict,default=None,help="color of the atoms by species")
     parser_visual.add_argument("-ci","--color_index",type=dict,default=None,help="color of the atoms by index")
     parser_visual.add_argument("-fps","--frame_per_second",type=int,default=24,help="frame per second")
     parser_visual.add_argument("--postfix", type=str, default="", help="Postfix for output files")
+    parser_visual.add_argument("-j","--jobs",type=int,default=1,help="number of frames rendered in parallel (0: all cores)")
+    parser_visual.add_argument("--frames",type=str,default=None,help="trajectory frames to render, start:stop:step")
+    parser_visual.add_argument("--rmsd_threshold",type=float,default=None,help="skip frames whose RMSD from the last rendered frame is below this value")
+    parser_visual.add_argument("--no_cache",action='store_true',help="do not reuse or store rendered images in the render cache")
+    parser_visual.add_argument("--contact_sheet",action='store_true',help="tile all orientations into the output image")
+    parser_visual.add_argument("--reuse_scene",action='store_true',help="write atom geometry once into a reusable POV include and render views from small driver files")
+    parser_visual.add_argument("--cull",action='store_true',help="drop atoms fully hidden behind opaque atoms in each view before rendering")
+    parser_visual.add_argument("--preview",action='store_true',help="fast thumbnails: small canvas, no antialiasing, simple textures")
+    parser_visual.add_argument("--raster",action='store_true',help="draw depth sorted discs with numpy instead of running POV-Ray (implies --preview)")
+    parser_visual.add_argument("--workers",type=int,default=1,help="number of target files rendered in parallel (0: all cores)")
+    parser_visual.add_argument("--max_depth",type=int,default=None,help="maximum directory depth searched for target files (0: current directory only)")
+    parser_visual.add_argument("--include",type=str,nargs='+',default=None,help="glob patterns (file name or relative path) target files must match")
+    parser_visual.add_argument("--exclude",type=str,nargs='+',default=None,help="glob patterns of files or directories skipped in the target search")
     
     visual_subparsers = parser_visual.add_subparsers(dest="visual_command", help="Visual commands")
     visual_subparsers.add_parser("create_config", help="create default config file")
 
     parser_make_system = subparsers.add_parser('make_system', help='make packmol system')
     parser_make_system.add_argument("-c","--config",type=str,default=None,help="config file path")
+    parser_make_system.add_argument("-w","--workers",type=int,default=None,help="number of systems built in parallel")
     
     make_system_subparsers = parser_make_system.add_subparsers(dest="make_system_command", help="Make system commands")
     make_system_subparsers.add_parser("init_dir", help="initialize directory")
@@ -54,7 +72,7 @@ def main():
         elif hasattr(args, 'make_system_command') and args.make_system_command == 'init_config':
             init_config(preset=args.preset)
         else:
-            make_system(args.config)
+            make_system(args.config, workers=args.workers)
 
     else:
         parser.print_help()
@@ -1,3 +1,4 @@
 from .packmol import *
+from ._packmol_xyz import read_xyz, write_xyz
 
-__all__ = ['init_dir', 'init_config', 'make_system']
\ No newline at end of file
+__all__ = ['init_dir', 'init_config', 'make_system', 'read_xyz', 'write_xyz']
\ No newline at end of file
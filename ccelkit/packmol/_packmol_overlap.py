@@ -0,0 +1,156 @@
+import numpy as np
+from ase.cell import Cell
+from typing import List, Union
+
+class PeriodicCellList:
+    # linked-cell grid: 각 bin의 폭이 cutoff 이상이므로 cutoff 안의 원자는 항상 인접한 27개 bin 안에 있다
+    def __init__(self, cell:Union[Cell, np.ndarray], cutoff:float, capacity:int=1024):
+        self.cell = np.array(cell, dtype=float).reshape(3, 3)
+        self.inv_cell = np.linalg.inv(self.cell)
+        self.cutoff = float(cutoff)
+
+        volume = abs(np.linalg.det(self.cell))
+        heights = np.array([volume / np.linalg.norm(np.cross(self.cell[(i+1)%3], self.cell[(i+2)%3])) for i in range(3)])
+        if self.cutoff > 0:
+            self.n_bins = np.maximum(1, np.floor(heights / self.cutoff)).astype(int)
+        else:
+            self.n_bins = np.ones(3, dtype=int)
+
+        self.bins = [[] for _ in range(int(np.prod(self.n_bins)))]
+        self.positions = np.empty((max(1, capacity), 3))
+        self.length = 0
+
+        offsets = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)])
+        self.neighbor_offsets = offsets
+
+    def __len__(self)->int:
+        return self.length
+
+    def _bin_indices(self, positions:np.ndarray)->np.ndarray:
+        scaled = positions @ self.inv_cell
+        scaled -= np.floor(scaled)
+        bin_indices = np.floor(scaled * self.n_bins).astype(int)
+        return bin_indices % self.n_bins
+
+    def _flat(self, bin_indices:np.ndarray)->np.ndarray:
+        return np.ravel_multi_index(bin_indices.T, self.n_bins, mode='wrap')
+
+    def mic_distances(self, position:np.ndarray, positions:np.ndarray)->np.ndarray:
+        d = positions - position
+        scaled = d @ self.inv_cell
+        scaled -= np.round(scaled)
+        d = scaled @ self.cell
+        return np.sqrt((d * d).sum(axis=1))
+
+    def insert(self, positions:np.ndarray)->None:
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        n_new = len(positions)
+        if self.length + n_new > len(self.positions):
+            capacity = max(2 * len(self.positions), self.length + n_new)
+            buffer = np.empty((capacity, 3))
+            buffer[:self.length] = self.positions[:self.length]
+            self.positions = buffer
+        self.positions[self.length:self.length+n_new] = positions
+        for i, flat in enumerate(self._flat(self._bin_indices(positions))):
+            self.bins[flat].append(self.length + i)
+        self.length += n_new
+
+    def neighbors(self, position:np.ndarray)->np.ndarray:
+        bin_index = self._bin_indices(np.asarray(position, dtype=float).reshape(1, 3))[0]
+        flats = np.unique(self._flat(bin_index + self.neighbor_offsets))
+        indices = [i for flat in flats for i in self.bins[flat]]
+        return np.array(indices, dtype=int)
+
+    def overlap_mask(self, positions:np.ndarray, chunk_size:int=4096)->np.ndarray:
+        # 모든 positions 를 한 번에 검사: 등록된 원자와 cutoff 미만으로 가까운 position 이면 True
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        mask = np.zeros(len(positions), dtype=bool)
+        if self.length == 0 or len(positions) == 0:
+            return mask
+
+        # bin 순서로 정렬한 CSR 배열
+        flats = self._flat(self._bin_indices(self.positions[:self.length]))
+        order = np.argsort(flats, kind='stable')
+        counts = np.bincount(flats, minlength=len(self.bins))
+        starts = np.cumsum(counts) - counts
+
+        n_offsets = len(self.neighbor_offsets)
+        for chunk_start in range(0, len(positions), chunk_size):
+            chunk = positions[chunk_start:chunk_start+chunk_size]
+            bin_indices = self._bin_indices(chunk)
+            neighbor_flats = self._flat((bin_indices[:, None, :] + self.neighbor_offsets[None, :, :]).reshape(-1, 3))
+            neighbor_flats = np.sort(neighbor_flats.reshape(len(chunk), n_offsets), axis=1)
+            unique = np.ones(neighbor_flats.shape, dtype=bool)
+            unique[:, 1:] = neighbor_flats[:, 1:] != neighbor_flats[:, :-1]
+
+            query = np.repeat(np.arange(len(chunk)), n_offsets)[unique.ravel()]
+            neighbor_flats = neighbor_flats.ravel()[unique.ravel()]
+            pair_counts = counts[neighbor_flats]
+            n_pairs = pair_counts.sum()
+            if n_pairs == 0:
+                continue
+            pair_query = np.repeat(query, pair_counts)
+            pair_offsets = np.arange(n_pairs) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+            pair_atoms = order[np.repeat(starts[neighbor_flats], pair_counts) + pair_offsets]
+
+            d = self.positions[pair_atoms] - chunk[pair_query]
+            scaled = d @ self.inv_cell
+            scaled -= np.round(scaled)
+            d = scaled @ self.cell
+            close = np.sqrt((d * d).sum(axis=1)) < self.cutoff
+            mask[chunk_start + pair_query[close]] = True
+        return mask
+
+    def overlaps(self, positions:np.ndarray)->bool:
+        # positions 중 하나라도 등록된 원자와 cutoff 미만(minimum image)으로 가까우면 True
+        if self.length == 0:
+            return False
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        for position in positions:
+            indices = self.neighbors(position)
+            if len(indices) == 0:
+                continue
+            if self.mic_distances(position, self.positions[indices]).min() < self.cutoff:
+                return True
+        return False
+
+def filter_overlapping_molecules(positions:np.ndarray, cell:Union[Cell, np.ndarray], cutoff:float, molecules:List[List[int]])->np.ndarray:
+    # 앞의 분자부터 차례로 받아들이고, 이미 받아들인 분자와 cutoff 미만으로 가까운 분자는 버린다. 받아들인 분자면 True
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    grid = PeriodicCellList(cell, cutoff, capacity=len(positions))
+    accepted = np.zeros(len(molecules), dtype=bool)
+    for mol_id, mol_indices in enumerate(molecules):
+        mol_positions = positions[mol_indices]
+        if grid.overlaps(mol_positions):
+            continue
+        grid.insert(mol_positions)
+        accepted[mol_id] = True
+    return accepted
+
+def get_molecule_overlaps(fixed_positions:np.ndarray, positions:np.ndarray, cell:Union[Cell, np.ndarray], cutoff:float, mol_ids:np.ndarray, num_molecules:int)->np.ndarray:
+    # fixed_positions (고체) 와 cutoff 미만으로 가까운 원자가 하나라도 있는 분자면 True. mol_ids 는 positions 의 원자별 분자 번호
+    fixed_positions = np.asarray(fixed_positions, dtype=float).reshape(-1, 3)
+    grid = PeriodicCellList(cell, cutoff, capacity=len(fixed_positions))
+    grid.insert(fixed_positions)
+    # 모든 원자를 한 번에 검사한 뒤 분자 단위로 모은다
+    atom_overlaps = grid.overlap_mask(positions)
+    return np.bincount(mol_ids, weights=atom_overlaps, minlength=num_molecules) > 0
+
+def get_excluded_volume(positions:np.ndarray, cell:Union[Cell, np.ndarray], radius:float, spacing:float=0.5)->float:
+    # 원자들로부터 radius 안에 있는 부피를 격자점 비율로 계산한다 (고체가 차지해서 유체가 들어갈 수 없는 부피)
+    cell = np.array(cell, dtype=float).reshape(3, 3)
+    volume = abs(np.linalg.det(cell))
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    if len(positions) == 0:
+        return 0.0
+    grid = PeriodicCellList(cell, radius, capacity=len(positions))
+    grid.insert(positions)
+
+    n_points = np.maximum(1, np.ceil(np.linalg.norm(cell, axis=1) / spacing)).astype(int)
+    scaled_axes = [(np.arange(n) + 0.5) / n for n in n_points]
+    scaled_yz = np.stack(np.meshgrid(scaled_axes[1], scaled_axes[2], indexing='ij'), axis=-1).reshape(-1, 2)
+    num_excluded = 0
+    for scaled_x in scaled_axes[0]:
+        scaled = np.column_stack([np.full(len(scaled_yz), scaled_x), scaled_yz])
+        num_excluded += grid.overlap_mask(scaled @ cell).sum()
+    return volume * num_excluded / np.prod(n_points)
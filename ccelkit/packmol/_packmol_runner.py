@@ -0,0 +1,160 @@
+import os, time, signal, asyncio, subprocess
+from typing import List, Dict, Any, Callable, Union
+
+# 시간 초과로 종료한 뒤 남은 출력을 읽을 때 기다리는 시간 (초)
+KILL_GRACE = 1.0
+
+class PackmolRun:
+    def __init__(self, seed:int, attempt:int, returncode:Union[int, None], wall_time:float, converged:bool, timed_out:bool, output_path:str, log:str=''):
+        self.seed = seed
+        self.attempt = attempt
+        self.returncode = returncode
+        self.wall_time = wall_time
+        self.converged = converged
+        self.timed_out = timed_out
+        self.output_path = output_path
+        self.log = log
+
+    def __str__(self):
+        status = 'timeout' if self.timed_out else ('converged' if self.converged else 'not converged')
+        return f"packmol seed {self.seed} (attempt {self.attempt}): {status}, {self.wall_time:.2f} s"
+
+    @property
+    def has_output(self)->bool:
+        return (not self.timed_out) and os.path.exists(self.output_path)
+
+    def get_info(self)->Dict[str, Any]:
+        return {"seed": self.seed, "attempt": self.attempt, "returncode": self.returncode,
+                "wall_time": round(self.wall_time, 3), "converged": self.converged, "timed_out": self.timed_out}
+
+def get_packmol_timeout(num_molecules:int, base_timeout:float=30.0, timeout_per_molecule:float=0.05)->float:
+    return base_timeout + timeout_per_molecule * num_molecules
+
+def is_packmol_converged(returncode:Union[int, None], stdout:str)->bool:
+    # packmol 은 수렴하면 'Success!' 를, 실패하면 'ENDED WITHOUT PERFECT PACKING' 을 출력한다
+    return returncode == 0 and 'Success!' in stdout
+
+def get_log_tail(stdout:str, stderr:str, num_lines:int=20)->str:
+    lines = (stdout + stderr).strip().splitlines()
+    return "\n".join(lines[-num_lines:])
+
+def remove_stale_output(output_path:str)->None:
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    return None
+
+def kill_process_group(pid:int)->None:
+    # packmol 이 wrapper script 로 실행되면 손자 프로세스가 pipe 를 잡고 있으므로 process group 전체를 종료한다
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    return None
+
+def run_packmol(packmol_path:str, inp_str:str, output_path:str, timeout:float, seed:int=0, attempt:int=0)->PackmolRun:
+    remove_stale_output(output_path)
+    start = time.perf_counter()
+    process = subprocess.Popen([packmol_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True, start_new_session=True)
+    try:
+        stdout, stderr = process.communicate(inp_str, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_group(process.pid)
+        # 종료된 뒤에는 pipe 가 닫히므로 그때까지의 출력을 읽을 수 있다. pipe 를 잡은 프로세스가 남아 있으면 기다리지 않는다
+        try:
+            stdout, _ = process.communicate(timeout=KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            stdout = ''
+        process.wait()
+        return PackmolRun(seed, attempt, None, time.perf_counter() - start, False, True, output_path, get_log_tail(stdout or '', ''))
+    wall_time = time.perf_counter() - start
+    converged = is_packmol_converged(process.returncode, stdout)
+    return PackmolRun(seed, attempt, process.returncode, wall_time, converged, False, output_path, get_log_tail(stdout, stderr))
+
+async def read_stream(stream:asyncio.StreamReader, chunks:List[bytes])->None:
+    # 시간 초과로 종료되어도 그때까지 받은 출력을 남기도록 조금씩 읽는다
+    while True:
+        chunk = await stream.read(1 << 16)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+
+async def run_packmol_async(packmol_path:str, inp_str:str, output_path:str, timeout:float, seed:int=0, attempt:int=0)->PackmolRun:
+    remove_stale_output(output_path)
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(packmol_path, stdin=asyncio.subprocess.PIPE,
+                                                   stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                   start_new_session=True)
+    stdout_chunks, stderr_chunks = [], []
+    readers = [asyncio.ensure_future(read_stream(process.stdout, stdout_chunks)),
+               asyncio.ensure_future(read_stream(process.stderr, stderr_chunks))]
+
+    async def communicate()->None:
+        try:
+            process.stdin.write(inp_str.encode())
+            await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        await process.wait()
+        await asyncio.wait(readers)
+
+    try:
+        await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        kill_process_group(process.pid)
+        await process.wait()
+        # pipe 를 잡은 프로세스가 남아 있어도 KILL_GRACE 이상 기다리지 않는다
+        await asyncio.wait(readers, timeout=KILL_GRACE)
+        for reader in readers:
+            reader.cancel()
+        stdout = b''.join(stdout_chunks).decode(errors='replace')
+        return PackmolRun(seed, attempt, None, time.perf_counter() - start, False, True, output_path, get_log_tail(stdout, ''))
+    wall_time = time.perf_counter() - start
+    stdout = b''.join(stdout_chunks).decode(errors='replace')
+    stderr = b''.join(stderr_chunks).decode(errors='replace')
+    converged = is_packmol_converged(process.returncode, stdout)
+    return PackmolRun(seed, attempt, process.returncode, wall_time, converged, False, output_path, get_log_tail(stdout, stderr))
+
+def run_packmol_with_retries(packmol_path:str, make_inp_str:Callable[[int], str], output_path:str, timeout:float, seed:int, retries:int=2, seed_stride:int=1)->List[PackmolRun]:
+    # 실패하면 seed 를 seed_stride 만큼 바꿔서 다시 실행한다. make_inp_str(seed) 는 해당 seed 의 입력 문자열을 만든다
+    runs = []
+    for attempt in range(retries + 1):
+        attempt_seed = seed + attempt * seed_stride
+        run = run_packmol(packmol_path, make_inp_str(attempt_seed), output_path, timeout, attempt_seed, attempt)
+        runs.append(run)
+        if run.converged:
+            break
+        print(f"Packmol 실패: {run}")
+    return runs
+
+async def run_packmol_with_retries_async(packmol_path:str, make_inp_str:Callable[[int], str], output_path:str, timeout:float, seed:int, retries:int=2, seed_stride:int=1)->List[PackmolRun]:
+    runs = []
+    for attempt in range(retries + 1):
+        attempt_seed = seed + attempt * seed_stride
+        run = await run_packmol_async(packmol_path, make_inp_str(attempt_seed), output_path, timeout, attempt_seed, attempt)
+        runs.append(run)
+        if run.converged:
+            break
+        print(f"Packmol 실패: {run}")
+    return runs
+
+async def run_packmol_jobs(packmol_path:str, jobs:List[tuple], max_jobs:int, retries:int=2, seed_stride:int=1)->List[List[PackmolRun]]:
+    # jobs: (make_inp_str, output_path, timeout, seed) 의 list. 최대 max_jobs 개의 packmol 을 동시에 실행한다
+    semaphore = asyncio.Semaphore(max(1, max_jobs))
+
+    async def run_job(make_inp_str:Callable[[int], str], output_path:str, timeout:float, seed:int)->List[PackmolRun]:
+        async with semaphore:
+            return await run_packmol_with_retries_async(packmol_path, make_inp_str, output_path, timeout, seed, retries, seed_stride)
+
+    return await asyncio.gather(*[run_job(*job) for job in jobs])
+
+def check_packmol_runs(runs:List[PackmolRun])->PackmolRun:
+    # 마지막 시도가 수렴하지 않았어도 결과 파일이 있으면 경고 후 사용하고, 결과가 없으면 에러를 낸다
+    run = runs[-1]
+    if run.converged:
+        return run
+    if run.has_output:
+        print(f"\033[93m경고: Packmol 이 {len(runs)}번 시도 후에도 수렴하지 않았습니다. 마지막 결과를 사용합니다. ({run})\033[0m")
+        return run
+    raise RuntimeError(f"Packmol 이 {len(runs)}번 시도 후에도 결과를 만들지 못했습니다. ({run})\n{run.log}")
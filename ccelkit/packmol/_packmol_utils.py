@@ -1,13 +1,15 @@
 import numpy as np
-import ase, os
+import ase, os, copy, hashlib, pickle, tempfile
 from ase.io import read, write
 from ase import Atoms
 from ._packmol_class import *
-from typing import List, Dict, Any, Callable
+from ._packmol_xyz import write_xyz
+from typing import List, Dict, Any, Callable, Union
 import subprocess
 from ase.cell import Cell
 from ase.build import molecule
 from ase.collections import g2
+from ase import units
 
 
 def check_root_dir(root_dir=os.getcwd())->None:
@@ -43,7 +45,7 @@ def read_psolid(pobj_path:str)->PSolid:
     name = get_filename(pobj_path)
 
     xyz_atoms_path = os.path.join("/".join(pobj_path.split('/')[:-1]), f'pinp_{name}.xyz')
-    write(xyz_atoms_path, atoms, format='xyz')
+    write_xyz(xyz_atoms_path, atoms)
 
     pobj = PSolid(xyz_atoms_path, atoms, name, ptype)
     pobj.set_system_info()
@@ -58,7 +60,7 @@ def read_pfluid(pobj_path:str)->PFluid:
     name = get_filename(pobj_path)
 
     xyz_atoms_path = os.path.join("/".join(pobj_path.split('/')[:-1]), f'pinp_{name}.xyz')
-    write(xyz_atoms_path, atoms, format='xyz')
+    write_xyz(xyz_atoms_path, atoms)
 
     pobj = PFluid(xyz_atoms_path, atoms, name, ptype)
 
@@ -83,6 +85,80 @@ def read_pcell(cell_path:str)->PCell:
     
     return pobj
 
+CACHE_VERSION = 1
+
+def get_file_stat(filepath:str)->Dict[str, int]:
+    stat = os.stat(filepath)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+def get_file_hash(filepath:str)->str:
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def get_cache_path(pobj_path:str, ptype:str, cache_dir:str)->str:
+    key = hashlib.sha1(f"{ptype}:{os.path.abspath(pobj_path)}".encode()).hexdigest()
+    return os.path.join(cache_dir, f'{ptype}_{get_filename(pobj_path)}_{key[:16]}.pkl')
+
+def load_cached_pobj(pobj_path:str, ptype:str, cache_dir:str)->Union[PObj, None]:
+    cache_path = get_cache_path(pobj_path, ptype, cache_dir)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            entry = pickle.load(f)
+    except Exception:
+        return None
+    if entry.get("version") != CACHE_VERSION:
+        return None
+
+    # mtime/size 가 같으면 그대로 사용하고, 다르면 내용의 hash 로 한 번 더 확인한다
+    src_stat = get_file_stat(pobj_path)
+    if src_stat != entry["src_stat"]:
+        if get_file_hash(pobj_path) != entry["src_hash"]:
+            return None
+        entry["src_stat"] = src_stat
+        save_cache_entry(cache_path, entry)
+
+    # pinp 파일이 없거나 바뀐 경우에만 다시 쓴다
+    pobj = entry["pobj"]
+    if not os.path.exists(pobj.path) or get_file_stat(pobj.path) != entry["pinp_stat"]:
+        write_xyz(pobj.path, pobj.atoms)
+        entry["pinp_stat"] = get_file_stat(pobj.path)
+        save_cache_entry(cache_path, entry)
+    return pobj
+
+def save_cache_entry(cache_path:str, entry:dict)->None:
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(entry, f)
+    os.replace(temp_path, cache_path)
+    return None
+
+def save_cached_pobj(pobj:PObj, pobj_path:str, cache_dir:str)->None:
+    entry = {
+        "version": CACHE_VERSION,
+        "src_stat": get_file_stat(pobj_path),
+        "src_hash": get_file_hash(pobj_path),
+        "pinp_stat": get_file_stat(pobj.path),
+        "pobj": pobj,
+    }
+    save_cache_entry(get_cache_path(pobj_path, pobj.type, cache_dir), entry)
+    return None
+
+def read_cached_pobj(pobj_path:str, ptype:str, cache_dir:Union[str, None]=None)->PObj:
+    if cache_dir is None:
+        return read_pobj(pobj_path, ptype)
+    pobj = load_cached_pobj(pobj_path, ptype, cache_dir)
+    if pobj is None:
+        pobj = read_pobj(pobj_path, ptype)
+        save_cached_pobj(pobj, pobj_path, cache_dir)
+    return pobj
+
 def read_pobj(pobj_path:str, ptype:str)->PObj:
     if ptype == 'solid':
         return read_psolid(pobj_path)
@@ -112,46 +188,146 @@ def check_pcell(pcell:PCell)->None:
     
     return True
 
-def density_to_number(density:float, molar_mass:float, molar_atom_number:float, cell_volume:float)->int:
+def density_to_number(density:Union[float, np.ndarray], molar_mass:Union[float, np.ndarray], molar_atom_number:Union[float, np.ndarray], cell_volume:float)->Union[int, np.ndarray]:
     # density = [g/cm^3]
     # molar_mass = [g/mol]
     # cell_volume = [Angstrom^3]
-    # return number of atoms
+    # return number of molecules (array 입력이면 성분별 array)
 
-    density = density * (1e-8**3) * (1/molar_mass) * (6.02e23) # g/cm^3 -> molecule_number /Angstrom^3
+    density = np.asarray(density, dtype=float) * (1e-8**3) / np.asarray(molar_mass, dtype=float) * units._Nav # g/cm^3 -> molecule_number /Angstrom^3
 
-    number = density * cell_volume # molecule_number /Angstrom^3 * Angstrom^3 -> molecule_number
+    number = np.floor(density * cell_volume).astype(int) # molecule_number /Angstrom^3 * Angstrom^3 -> molecule_number
 
-    
-    return int(number)
+    return int(number) if number.ndim == 0 else number
+
+def solve_composition(density:float, fractions:List[float], molar_masses:List[float], volume:float, basis:str='mole')->np.ndarray:
+    # 전체 밀도 [g/cm^3] 와 성분비 (mole 또는 mass fraction) 로 모든 성분의 분자 수를 한 번에 구한다
+    fractions = np.asarray(fractions, dtype=float)
+    molar_masses = np.asarray(molar_masses, dtype=float)
+    fractions = fractions / fractions.sum()
+    if basis == 'mole':
+        mass_fractions = fractions * molar_masses / np.dot(fractions, molar_masses)
+    elif basis == 'mass':
+        mass_fractions = fractions
+    else:
+        raise ValueError(f"The basis {basis} is not valid. (mole or mass)")
+    return density_to_number(density * mass_fractions, molar_masses, None, volume)
+
+def get_num_molecules(point:Dict[str, dict], pfluids:List[PFluid], cell_volume:float, free_volume:float)->Dict[str, int]:
+    num_molecules = {}
+    composition = point.get('composition')
+    fractions = composition['fractions'] if composition else {}
 
+    density_fluids = [pobj for pobj in pfluids if pobj.name not in fractions and point['fluid'][pobj.name]['type'] == 'density']
+    if density_fluids:
+        numbers = density_to_number([point['fluid'][pobj.name]['value'] for pobj in density_fluids],
+                                    [pobj.info['system']['molar_mass'] for pobj in density_fluids],
+                                    [pobj.info['system']['molar_length'] for pobj in density_fluids], cell_volume)
+        num_molecules.update({pobj.name: int(number) for pobj, number in zip(density_fluids, numbers)})
 
-def read_fluid_src(src_dir:str)->List[PFluid]:
+    for pobj in pfluids:
+        if pobj.name in fractions or pobj.name in num_molecules:
+            continue
+        v_type = point['fluid'][pobj.name]['type']
+        if v_type != 'number':
+            raise ValueError(f"The type {v_type} of {pobj.name} is not valid. (density or number)")
+        num_molecules[pobj.name] = point['fluid'][pobj.name]['value']
+
+    if composition:
+        pobj_dict = {pobj.name: pobj for pobj in pfluids}
+        names = list(fractions.keys())
+        numbers = solve_composition(composition['density'], [fractions[name] for name in names],
+                                    [pobj_dict[name].info['system']['molar_mass'] for name in names], free_volume,
+                                    composition.get('basis', 'mole'))
+        num_molecules.update({name: int(number) for name, number in zip(names, numbers)})
+    return num_molecules
+
+def expand_sweep_value(value:Any)->List[float]:
+    # value: 숫자, 숫자 list, 또는 {start, stop, step} (stop 포함)
+    if isinstance(value, dict):
+        start, stop, step = value['start'], value['stop'], value['step']
+        num = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return [round(start + i * step, 10) for i in range(num)]
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+def get_sweep_points(fluid_config:Dict[str, dict], composition:Union[dict, None]=None)->List[Dict[str, dict]]:
+    # list/range 값을 가진 유체들(과 composition 의 density)은 같은 길이여야 하며 index 순서대로 짝지어진다
+    # composition 으로만 정해지는 유체는 fluid 항목을 비워둘 수 있다
+    fluid_config = {name: setting for name, setting in fluid_config.items() if setting}
+    expanded = {name: expand_sweep_value(setting['value']) for name, setting in fluid_config.items()}
+    if composition:
+        expanded['composition'] = expand_sweep_value(composition['density'])
+    lengths = {len(values) for values in expanded.values() if len(values) > 1}
+    if len(lengths) > 1:
+        raise ValueError(f"sweep 값들의 길이가 서로 다릅니다: { {name: len(values) for name, values in expanded.items()} }")
+    num_points = lengths.pop() if lengths else 1
+
+    def get_value(values:list, point_idx:int)->Any:
+        return values[point_idx] if len(values) > 1 else values[0]
+
+    sweep_points = []
+    for point_idx in range(num_points):
+        point = {"fluid": {}}
+        for name, setting in fluid_config.items():
+            point["fluid"][name] = {"type": setting['type'], "value": get_value(expanded[name], point_idx)}
+        if composition:
+            point["composition"] = dict(composition, density=get_value(expanded['composition'], point_idx), fractions=dict(composition['fractions']))
+        sweep_points.append(point)
+    return sweep_points
+
+def get_sub_boxes(box_info:Dict[str, float], decomposition:List[int])->List[Dict[str, float]]:
+    edges = [np.linspace(box_info[f'{axis}_min'], box_info[f'{axis}_max'], n + 1) for axis, n in zip('xyz', decomposition)]
+    sub_boxes = []
+    for i in range(decomposition[0]):
+        for j in range(decomposition[1]):
+            for k in range(decomposition[2]):
+                sub_boxes.append({
+                    "x_min": float(edges[0][i]), "x_max": float(edges[0][i+1]),
+                    "y_min": float(edges[1][j]), "y_max": float(edges[1][j+1]),
+                    "z_min": float(edges[2][k]), "z_max": float(edges[2][k+1]),
+                })
+    return sub_boxes
+
+def split_number(number:int, parts:int)->List[int]:
+    base, remainder = divmod(number, parts)
+    return [base + 1 if i < remainder else base for i in range(parts)]
+
+def get_sub_pfluid(pobj:PFluid, sub_box:Dict[str, float], num_molecules:int)->PFluid:
+    sub_pobj = copy.copy(pobj)
+    sub_pobj.info = {'system': dict(pobj.info['system']), 'surrounding': dict(pobj.info['surrounding'])}
+    sub_pobj.set_system_info(sub_box)
+    sub_pobj.set_system_info({"num_molecules": num_molecules})
+    return sub_pobj
+
+def read_fluid_src(src_dir:str, cache_dir:Union[str, None]=None)->List[PFluid]:
     pobjs = []
     fluid_dir = os.path.join(src_dir, 'fluid')
     for file in os.listdir(fluid_dir):
         if file.startswith('pinp_'):
             continue
-        pobj = read_pfluid(os.path.join(fluid_dir, file))
+        pobj = read_cached_pobj(os.path.join(fluid_dir, file), 'fluid', cache_dir)
         pobjs.append(pobj)
     return pobjs
 
-def read_solid_src(src_dir:str)->List[PSolid]:
+def read_solid_src(src_dir:str, cache_dir:Union[str, None]=None)->List[PSolid]:
     pobjs = []
     solid_dir = os.path.join(src_dir, 'solid')
     for file in os.listdir(solid_dir):
         if file.startswith('pinp_'):
             continue
-        pobj = read_psolid(os.path.join(solid_dir, file))
+        pobj = read_cached_pobj(os.path.join(solid_dir, file), 'solid', cache_dir)
         pobjs.append(pobj)
     return pobjs
 
-def read_src(src_dir:str)->Dict[str, List[PObj]]:
+def read_src(src_dir:str, use_cache:bool=False)->Dict[str, List[PObj]]:
     pobjs = {"cell":None, "fluid":[], "solid":[]}
     pcell = read_pcell(os.path.join(src_dir, 'cell_POSCAR'))
 
-    pliquids = read_fluid_src(src_dir)
-    psolids = read_solid_src(src_dir)
+    cache_dir = os.path.join(src_dir, '.cache') if use_cache else None
+    pliquids = read_fluid_src(src_dir, cache_dir)
+    psolids = read_solid_src(src_dir, cache_dir)
 
     pobjs["cell"] = pcell
     pobjs["fluid"] = pliquids
@@ -168,6 +344,12 @@ def write_fluid_packmol_inp(pfluids:List[PFluid])->None:
         packmol_str += pobj.to_packmol_str()
     return packmol_str
 
+def write_packmol_inp(pfluids:List[PFluid], tolerance:float, output_path:str, seed:int)->str:
+    packmol_str = write_packmol_header(tolerance, seed)
+    packmol_str += f"output {output_path}\n\n"
+    packmol_str += write_fluid_packmol_inp(pfluids)
+    return packmol_str
+
 
 def set_preset(src_dir: str) -> None:
     # (1) cell_POSCAR 파일 작성
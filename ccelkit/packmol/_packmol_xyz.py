@@ -0,0 +1,43 @@
+import numpy as np
+from ase import Atoms
+from ase.data import atomic_numbers, chemical_symbols
+
+def read_xyz(xyz_path:str)->Atoms:
+    # packmol 출력과 같은 plain xyz (첫 frame) 전용 reader
+    with open(xyz_path, 'r') as f:
+        text = f.read()
+    lines = text.split('\n', 2)
+    num_atoms = int(lines[0].split()[0])
+    if num_atoms == 0:
+        return Atoms()
+    if len(lines) < 3:
+        raise ValueError(f"The file {xyz_path} has less than {num_atoms} atoms.")
+    body = lines[2]
+
+    first_line = body.split('\n', 1)[0]
+    num_columns = len(first_line.split())
+    if num_columns < 4:
+        raise ValueError(f"The file {xyz_path} is not a valid xyz file.")
+    tokens = body.split(maxsplit=num_atoms * num_columns)[:num_atoms * num_columns]
+    if len(tokens) < num_atoms * num_columns:
+        raise ValueError(f"The file {xyz_path} has less than {num_atoms} atoms.")
+
+    # 문자열 list 를 열 단위로 바로 float 배열로 변환하는 것이 가장 빠르다
+    positions = np.empty((num_atoms, 3))
+    for axis in range(3):
+        positions[:, axis] = np.array(tokens[axis+1::num_columns], dtype=float)
+
+    symbol_ids = {}
+    ids = np.fromiter((symbol_ids.setdefault(symbol, len(symbol_ids)) for symbol in tokens[0::num_columns]), dtype=int, count=num_atoms)
+    numbers = np.array([atomic_numbers[symbol.capitalize()] for symbol in symbol_ids], dtype=int)[ids]
+    return Atoms(numbers=numbers, positions=positions)
+
+def write_xyz(xyz_path:str, atoms:Atoms, comment:str='')->None:
+    symbols = [chemical_symbols[number] for number in atoms.numbers]
+    # numpy scalar 대신 python float 로 formatting 하는 편이 빠르다
+    line_format = '%-2s %22.15f %22.15f %22.15f\n'
+    lines = map(line_format.__mod__, ((symbol, *position) for symbol, position in zip(symbols, atoms.get_positions().tolist())))
+    with open(xyz_path, 'w') as f:
+        f.write(f"{len(atoms)}\n{comment}\n")
+        f.writelines(lines)
+    return None
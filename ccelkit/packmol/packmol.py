@@ -1,11 +1,17 @@
-import os, yaml
+import os, yaml, asyncio, tempfile
 from argparse import ArgumentParser
 import numpy as np
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from typing import List, Dict, Any, Tuple
 from ase.cell import Cell
 from ase.io import read, write
 from ._packmol_utils import *
 from ._packmol_class import *
+from ._packmol_overlap import filter_overlapping_molecules, get_molecule_overlaps, get_excluded_volume
+from ._packmol_xyz import read_xyz
+from ._packmol_runner import get_packmol_timeout, run_packmol_with_retries, run_packmol_jobs, check_packmol_runs
 
 def init_dir(root_dir=os.getcwd())->None:
     root_dir = os.path.abspath(root_dir)
@@ -52,14 +58,165 @@ def init_config(root_dir:str = os.getcwd(), preset:str = False)->None:
         "tolerance": 2.0,
         "seed": 42,
         "population": 5,
-        "solid_fluid_tolerance": 3.0
+        "solid_fluid_tolerance": 3.0,
+        "workers": None,
+        "keep_intermediates": False,
+        "cache": True,
+        "packmol_timeout": 30.0,
+        "packmol_timeout_per_molecule": 0.05,
+        "packmol_retries": 2
     }
     with open(os.path.join(root_dir, 'config_init.yml'), 'w') as f:
         yaml.dump(config, f, indent=4)
     return None
 
 
-def make_system(config_path:str)->None:
+def pack_sub_boxes(system_idx:int, config:dict, pfluids:List[PFluid], num_molecules:Dict[str, int], box_info:dict, work_dir:str, packmol_path:str)->Tuple[Atoms, List[Dict[str, Any]]]:
+    # cell 을 decomposition 개의 sub-box 로 나누어 각각 packmol 로 채운 뒤 이어붙인다
+    # sub-box 사이에는 tolerance 만큼의 여백이 생기고, 경계의 중복은 이후 유체 중복 제거 단계에서 정리된다
+    tolerance = config.get("tolerance", 2.0)
+    seed = config.get("seed", 42)
+    population = config['population']
+    sub_boxes = get_sub_boxes(box_info, config["decomposition"])
+    n_boxes = len(sub_boxes)
+    for sub_box in sub_boxes:
+        if min(sub_box[f'{axis}_max'] - sub_box[f'{axis}_min'] for axis in 'xyz') <= tolerance:
+            raise ValueError(f"decomposition {config['decomposition']} 의 sub-box 가 tolerance({tolerance}) 보다 작습니다.")
+    box_counts = {pobj.name: split_number(num_molecules[pobj.name], n_boxes) for pobj in pfluids}
+
+    jobs = []
+    job_pfluids = []
+    for box_idx, sub_box in enumerate(sub_boxes):
+        sub_pfluids = [get_sub_pfluid(pobj, sub_box, box_counts[pobj.name][box_idx]) for pobj in pfluids if box_counts[pobj.name][box_idx] > 0]
+        if not sub_pfluids:
+            continue
+        fluid_packmol_xyz = os.path.join(work_dir, f'fluid_packmol_{system_idx:02d}_box_{box_idx:02d}.xyz')
+        make_inp_str = partial(write_packmol_inp, sub_pfluids, tolerance, fluid_packmol_xyz)
+        timeout = get_packmol_timeout(sum(pobj.info['system']['num_molecules'] for pobj in sub_pfluids), config.get("packmol_timeout", 30.0), config.get("packmol_timeout_per_molecule", 0.05))
+        jobs.append((make_inp_str, fluid_packmol_xyz, timeout, seed + system_idx + box_idx * population))
+        job_pfluids.append((box_idx, sub_pfluids))
+
+    print(f"Packmol 실행 중: {len(jobs)}개의 sub-box ({system_idx:02d})")
+    max_jobs = config.get("decomposition_jobs", os.cpu_count())
+    job_runs = asyncio.run(run_packmol_jobs(packmol_path, jobs, max_jobs, retries=config.get("packmol_retries", 2), seed_stride=population * n_boxes))
+
+    # 유체별, sub-box 순서로 분자들을 모은다 (mol_indices 와 같은 순서)
+    blocks = {}
+    packmol_runs = []
+    for (box_idx, sub_pfluids), (make_inp_str, fluid_packmol_xyz, _, _), runs in zip(job_pfluids, jobs, job_runs):
+        run = check_packmol_runs(runs)
+        packmol_runs.extend([dict(run.get_info(), box=box_idx) for run in runs])
+        if config.get("keep_intermediates", False):
+            with open(os.path.splitext(fluid_packmol_xyz)[0] + '.inp', 'w') as f:
+                f.write(make_inp_str(run.seed))
+        box_atoms = read_xyz(fluid_packmol_xyz)
+        c = 0
+        for pobj in sub_pfluids:
+            length = pobj.info['system']['num_molecules'] * pobj.info['system']['molar_length']
+            blocks[(pobj.name, box_idx)] = box_atoms[c:c+length]
+            c += length
+
+    fluid_xyz = Atoms()
+    for pobj in pfluids:
+        for box_idx in range(n_boxes):
+            if (pobj.name, box_idx) in blocks:
+                fluid_xyz += blocks[(pobj.name, box_idx)]
+    return fluid_xyz, packmol_runs
+
+def build_system(system_idx:int, config:dict, pfluids:List[PFluid], solid_atoms:Atoms, num_molecules:Dict[str, int], cell:Cell, box_info:dict, out_dir:str, packmol_path:str)->Dict[str, Any]:
+    tolerance = config.get("tolerance", 2.0)
+    seed = config.get("seed", 42)
+
+    c = 0
+    for pobj in pfluids:
+        pobj.set_system_info({"tolerance": tolerance})
+        pobj.set_system_info(box_info)
+        num_atoms = num_molecules[pobj.name]
+        mol_indices = []
+        for i in range(num_atoms):
+            mol_indices.append(list(range(c, c+pobj.info['system']['molar_length'])))
+            c += pobj.info['system']['molar_length']
+        pobj.set_system_info({"num_molecules": num_atoms, "mol_indices": mol_indices})
+
+    # packmol 입력/출력은 keep_intermediates 가 아니면 임시 디렉토리에서만 사용한다
+    keep_intermediates = config.get("keep_intermediates", False)
+    with tempfile.TemporaryDirectory(prefix='ccelkit_packmol_') as scratch_dir:
+        work_dir = out_dir if keep_intermediates else scratch_dir
+
+        if np.prod(config.get("decomposition", [1, 1, 1])) > 1:
+            fluid_xyz, packmol_runs = pack_sub_boxes(system_idx, config, pfluids, num_molecules, box_info, work_dir, packmol_path)
+        else:
+            # make fluid packmol input
+            fluid_packmol_inp = os.path.join(work_dir, f'fluid_packmol_{system_idx:02d}.inp')
+            fluid_packmol_xyz = os.path.join(work_dir, f'fluid_packmol_{system_idx:02d}.xyz')
+            make_inp_str = partial(write_packmol_inp, pfluids, tolerance, fluid_packmol_xyz)
+            timeout = get_packmol_timeout(sum(num_molecules.values()), config.get("packmol_timeout", 30.0), config.get("packmol_timeout_per_molecule", 0.05))
+
+            print(f"Packmol 실행 중: {fluid_packmol_xyz}")
+            runs = run_packmol_with_retries(packmol_path, make_inp_str, fluid_packmol_xyz, timeout, seed + system_idx,
+                                            retries=config.get("packmol_retries", 2), seed_stride=config['population'])
+            run = check_packmol_runs(runs)
+            if keep_intermediates:
+                with open(fluid_packmol_inp, 'w') as f:
+                    f.write(make_inp_str(run.seed))
+
+            fluid_xyz = read_xyz(fluid_packmol_xyz)
+            packmol_runs = [run.get_info() for run in runs]
+    fluid_xyz.cell = cell
+    fluid_xyz.pbc = True
+    molecules = [mol_indices for pobj in pfluids for mol_indices in pobj.info['system']['mol_indices']]
+    mol_accepted = filter_overlapping_molecules(fluid_xyz.get_positions(), cell, config['tolerance'], molecules)
+    accepted_indices = []
+    c = 0
+    mol_id = 0
+    for pobj in pfluids:
+        a = 0
+        new_mol_indices = []
+        for mol_indices in pobj.info['system']['mol_indices']:
+            if mol_accepted[mol_id]:
+                accepted_indices.extend(mol_indices)
+                new_mol_indices.append(list(range(c, c+len(mol_indices))))
+                c += len(mol_indices)
+                a += 1
+            mol_id += 1
+        pobj.set_system_info({"num_atoms": a, "mol_indices": new_mol_indices})
+    fluid_non_duplicate = fluid_xyz[np.array(accepted_indices, dtype=int)]
+
+    if keep_intermediates:
+        fluid_non_duplicate.write(os.path.join(out_dir, f'fluid_non_duplicate_{system_idx:02d}_POSCAR'))
+        solid_atoms.write(os.path.join(out_dir, f'solid_{system_idx:02d}.xyz'), format='xyz')
+
+    system_atoms = solid_atoms.copy()
+    mol_ids = np.empty(len(fluid_non_duplicate), dtype=int)
+    n_mol = 0
+    for pobj in pfluids:
+        for mol_indices in pobj.info['system']['mol_indices']:
+            mol_ids[mol_indices] = n_mol
+            n_mol += 1
+    mol_overlaps = get_molecule_overlaps(system_atoms.get_positions(), fluid_non_duplicate.get_positions(), cell,
+                                         config['solid_fluid_tolerance'], mol_ids, n_mol)
+
+    accepted_indices = []
+    c = len(system_atoms)
+    mol_id = 0
+    for pobj in pfluids:
+        a = 0
+        new_mol_indices = []
+        for mol_indices in pobj.info['system']['mol_indices']:
+            if not mol_overlaps[mol_id]:
+                accepted_indices.extend(mol_indices)
+                new_mol_indices.append(list(range(c, c+len(mol_indices))))
+                c += len(mol_indices)
+                a += 1
+            mol_id += 1
+        
+        pobj.set_system_info({"num_atoms": a, "mol_indices": new_mol_indices})
+    system_atoms.extend(fluid_non_duplicate[np.array(accepted_indices, dtype=int)])
+    system_POSCAR_path = os.path.join(out_dir, f'system_{system_idx:02d}_POSCAR')
+    write(system_POSCAR_path, system_atoms)
+    return {"system": system_POSCAR_path, "packmol_runs": packmol_runs}
+
+def make_system(config_path:str, workers:int=None)->None:
     packmol_path = os.environ.get('PACKMOL')
     if packmol_path is None:
         raise EnvironmentError("PACKMOL 환경 변수가 설정되어 있지 않습니다.")
@@ -71,13 +228,13 @@ def make_system(config_path:str)->None:
 
     os.makedirs(out_dir, exist_ok=True)
 
-    tolerance = config.get("tolerance", 2.0)
-    seed = config.get("seed", 42)
+    if workers is None:
+        workers = config.get("workers")
 
-    pobjs = read_src(src_dir)
+    pobjs = read_src(src_dir, use_cache=config.get("cache", True))
     pcell = pobjs["cell"]
     pfluids = pobjs["fluid"]
-    psolids = pobjs["solid"] # not used
+    psolids = pobjs["solid"]
 
     cell = pcell.info['system']['cell']
     cell_array = cell.array
@@ -95,118 +252,53 @@ def make_system(config_path:str)->None:
         "z_max": z_max
     }
     
-    for system_idx in tqdm(range(config['population']), desc='시스템 생성 중'):
-        c = 0
-        for pobj in pfluids:
-            pobj.set_system_info({"tolerance": tolerance})
-            pobj.set_system_info(box_info)
-            v_type = config[pobj.type][pobj.name]['type']
-            v_value = config[pobj.type][pobj.name]['value']
-            if v_type == "density":
-                num_atoms = density_to_number(v_value, pobj.info['system']['molar_mass'], pobj.info['system']['molar_length'], cell_volume)
-            elif v_type == "number":
-                num_atoms = v_value
-            mol_indices = []
-            for i in range(num_atoms):
-                mol_indices.append(list(range(c, c+pobj.info['system']['molar_length'])))
-                c += pobj.info['system']['molar_length']
-            pobj.set_system_info({"num_molecules": num_atoms, "mol_indices": mol_indices})
-
-        # make fluid packmol input
-        fluid_packmol_inp = os.path.join(out_dir, f'fluid_packmol_{system_idx:02d}.inp')
-        fluid_packmol_xyz = os.path.join(out_dir, f'fluid_packmol_{system_idx:02d}.xyz')
-        with open(fluid_packmol_inp, 'w') as f:
-            f.write(write_packmol_header(tolerance, seed + system_idx))
-            f.write(f"output {fluid_packmol_xyz}\n\n")
-            f.write(write_fluid_packmol_inp(pfluids))
-
-        print(f"Packmol 실행 중: {fluid_packmol_inp}")
-        result = subprocess.run(f"{packmol_path} < {fluid_packmol_inp}", shell=True, timeout=30)
-
-        fluid_xyz = read(fluid_packmol_xyz, format='xyz')
-        fluid_xyz.cell = cell
-        fluid_xyz.pbc = True
-        fluid_non_duplicate = None
-        new_mol_indices = []
-        c = 0
-        for pobj in pfluids:
-            a = 0
-            num_mol = len(pobj.info['system']['mol_indices'])
-            new_mol_indices = []
-            for i in range(num_mol):
-                mol_indices = pobj.info['system']['mol_indices'][i]
-                mol_atoms = fluid_xyz[mol_indices]
-                if fluid_non_duplicate is None:
-                    fluid_non_duplicate = mol_atoms
-                    fluid_non_duplicate.cell = cell
-                    fluid_non_duplicate.pbc = True
-                    new_mol_indices.append(list(range(c, c+len(mol_atoms))))
-                    c += len(mol_atoms)
-                    a += 1
-                else:
-                    is_valid = True
-                    temp_atoms = fluid_non_duplicate.copy() + mol_atoms.copy()
-                    for t in range(len(mol_atoms)):
-                        d_array = temp_atoms.get_distances(a=len(fluid_non_duplicate)+t,indices=list(range(len(fluid_non_duplicate))), mic=True)
-                        if (d_array.min() < config['tolerance']):
-                            is_valid = False
-                            break
-                    if is_valid:
-                        fluid_non_duplicate = temp_atoms
-                        new_mol_indices.append(list(range(c, c+len(mol_atoms))))
-                        c += len(mol_atoms)
-                        a += 1
-            pobj.set_system_info({"num_atoms": a, "mol_indices": new_mol_indices})
-        
-        fluid_non_duplicate_POSCAR_path = os.path.join(out_dir, f'fluid_non_duplicate_{system_idx:02d}_POSCAR')
-        fluid_non_duplicate.write(fluid_non_duplicate_POSCAR_path)
-
-        solid_POSCAR = Atoms(cell=cell, pbc=True)
-        for psolid in psolids:
-            solid_atoms = psolid.atoms
-            solid_POSCAR += solid_atoms
-
-        solid_POSCAR.write(os.path.join(out_dir, 'solid.xyz'), format='xyz')
-
-        fluid_non_duplicate = read(fluid_non_duplicate_POSCAR_path)
-        solid_xyz = read(os.path.join(out_dir, 'solid.xyz'), format='xyz')
-        solid_length = len(solid_xyz)
-
-
-        system_atoms = solid_xyz.copy()
-        system_atoms.cell = cell
-        system_atoms.pbc = True
-        system_atoms.wrap()
-        system_temp = system_atoms.copy()
-
-        c = len(system_atoms)
-        for pobj in pfluids:
-            num_mol = len(pobj.info['system']['mol_indices'])
-            a = 0
-            new_mol_indices = []
-            for i in range(num_mol):
-                mol_indices = pobj.info['system']['mol_indices'][i]
-                mol_atoms = fluid_non_duplicate[mol_indices]
-                system_atoms_copied = system_temp.copy()    
-                system_atoms_copied += mol_atoms
-
-
-                is_valid = True
-                if solid_length > 0:
-                    for t in range(len(mol_atoms)):
-                        d_array = system_atoms_copied.get_distances(a=solid_length+t,indices=list(range(solid_length)), mic=True)
-                        if (d_array.min() < config['solid_fluid_tolerance']):
-                            is_valid = False
-                            break
-                else:
-                    is_valid = True
-
-                if is_valid:
-                    new_mol_indices.append(list(range(c, c+len(mol_atoms))))
-                    system_atoms += mol_atoms
-                    c += len(mol_atoms)
-                    a += 1
-            
-            pobj.set_system_info({"num_atoms": a, "mol_indices": new_mol_indices})
-        system_POSCAR_path = os.path.join(out_dir, f'system_{system_idx:02d}_POSCAR')
-        write(system_POSCAR_path, system_atoms)
\ No newline at end of file
+    # 고체 구조는 모든 시스템과 sweep point 에서 공유한다
+    solid_atoms = Atoms(cell=cell, pbc=True)
+    for psolid in psolids:
+        solid_atoms += psolid.atoms
+    solid_atoms.wrap()
+
+    # 성분비로 정해지는 유체는 고체가 차지하는 부피를 뺀 나머지 부피를 사용한다
+    composition = config.get("composition")
+    free_volume = cell_volume
+    if composition and composition.get("exclude_solid", True) and len(solid_atoms) > 0:
+        free_volume -= get_excluded_volume(solid_atoms.get_positions(), cell, config['solid_fluid_tolerance'])
+
+    sweep_points = get_sweep_points(config['fluid'], composition)
+    is_sweep = len(sweep_points) > 1
+    if is_sweep:
+        with open(os.path.join(out_dir, 'sweep.yml'), 'w') as f:
+            yaml.dump({f'sweep_{point_idx:02d}': point for point_idx, point in enumerate(sweep_points)}, f, indent=4)
+
+    # 분자 수는 population 과 무관하므로 시스템 생성 전에 한 번만 계산한다
+    population = config['population']
+    tasks = []
+    for point_idx, point in enumerate(sweep_points):
+        point_out_dir = os.path.join(out_dir, f'sweep_{point_idx:02d}') if is_sweep else out_dir
+        os.makedirs(point_out_dir, exist_ok=True)
+        num_molecules = get_num_molecules(point, pfluids, cell_volume, free_volume)
+        for system_idx in range(population):
+            tasks.append((system_idx, num_molecules, point_out_dir))
+
+    # workers 를 정하지 않으면 sweep 의 (point, 시스템) 들은 동시에, sweep 이 아니면 순서대로 생성한다
+    if workers is None:
+        workers = min(os.cpu_count(), len(tasks)) if is_sweep else 1
+    elif workers < 1:
+        workers = os.cpu_count()
+
+    results = []
+    if workers > 1 and len(tasks) > 1:
+        # 각 시스템은 seed + system_idx 와 시스템별 파일만 사용하므로 독립적으로 생성할 수 있다
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            futures = [executor.submit(build_system, system_idx, config, pfluids, solid_atoms, num_molecules, cell, box_info, point_out_dir, packmol_path)
+                       for system_idx, num_molecules, point_out_dir in tasks]
+            for future in tqdm(as_completed(futures), total=len(tasks), desc='시스템 생성 중'):
+                results.append(future.result())
+    else:
+        for system_idx, num_molecules, point_out_dir in tqdm(tasks, desc='시스템 생성 중'):
+            results.append(build_system(system_idx, config, pfluids, solid_atoms, num_molecules, cell, box_info, point_out_dir, packmol_path))
+
+    # packmol 실행 기록 (seed, wall time, 수렴 여부)
+    packmol_runs = {os.path.relpath(result["system"], out_dir): result["packmol_runs"] for result in results}
+    with open(os.path.join(out_dir, 'packmol_runs.yml'), 'w') as f:
+        yaml.dump(packmol_runs, f, indent=4)
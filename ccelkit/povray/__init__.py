@@ -1 +1,3 @@
 from .povray import *
+
+__all__ = ['visual', 'to_povray_image', 'render_atoms', 'render_frames']
\ No newline at end of file
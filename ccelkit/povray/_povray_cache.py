@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from ase import Atoms
+from PIL import Image
+from typing import Union
+
+RENDER_CACHE_VERSION = 1
+DEFAULT_CACHE_MAX_MB = 1024
+
+def get_cache_root() -> str:
+    cache_dir = os.environ.get("CCELKIT_CACHE_DIR")
+    if cache_dir:
+        return cache_dir
+    return os.path.join(os.path.expanduser("~"), ".cache", "ccelkit")
+
+def get_render_cache_dir() -> str:
+    return os.path.join(get_cache_root(), "render")
+
+def get_scene_cache_dir() -> str:
+    return os.path.join(get_cache_root(), "scene")
+
+def get_render_cache_max_bytes() -> int:
+    return int(float(os.environ.get("CCELKIT_CACHE_MAX_MB", DEFAULT_CACHE_MAX_MB)) * (1 << 20))
+
+def get_render_key(atoms: Atoms, render_settings: dict, array_names: tuple = ()) -> str:
+    # 구조(원자 번호, 위치, cell, pbc)와 렌더링 설정이 모두 같으면 같은 이미지가 나온다. array_names 는 이미지에 영향을 주는 atoms.arrays
+    sha256 = hashlib.sha256()
+    sha256.update(f"ccelkit-render-{RENDER_CACHE_VERSION}".encode())
+    sha256.update(np.ascontiguousarray(atoms.numbers, dtype=np.int64).tobytes())
+    sha256.update(np.ascontiguousarray(atoms.positions, dtype=np.float64).tobytes())
+    sha256.update(np.ascontiguousarray(atoms.cell.array, dtype=np.float64).tobytes())
+    sha256.update(np.ascontiguousarray(atoms.pbc, dtype=bool).tobytes())
+    for name in array_names:
+        if name in atoms.arrays:
+            sha256.update(name.encode())
+            sha256.update(np.ascontiguousarray(atoms.arrays[name], dtype=np.float64).tobytes())
+    sha256.update(json.dumps(render_settings, sort_keys=True, default=str).encode())
+    return sha256.hexdigest()
+
+def get_cached_image_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}.png")
+
+def load_cached_image(cache_dir: str, key: str) -> Union[Image.Image, None]:
+    image_path = get_cached_image_path(cache_dir, key)
+    try:
+        with Image.open(image_path) as img:
+            img.load()
+            img = img.copy()
+    except (OSError, ValueError):
+        return None
+    # LRU 정리를 위해 사용한 시각을 갱신한다
+    try:
+        os.utime(image_path)
+    except OSError:
+        pass
+    return img
+
+def save_cached_image(cache_dir: str, key: str, img: Image.Image) -> None:
+    image_path = get_cached_image_path(cache_dir, key)
+    os.makedirs(os.path.dirname(image_path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(image_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            img.save(f, format='PNG')
+        os.replace(temp_path, image_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return None
+
+def evict_render_cache(cache_dir: str, max_bytes: int, extensions: tuple = ('.png',)) -> None:
+    # 전체 크기가 max_bytes 를 넘으면 가장 오래 사용하지 않은 파일부터 지운다
+    if not os.path.isdir(cache_dir):
+        return None
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for file in files:
+            if not file.endswith(extensions):
+                continue
+            try:
+                stat = os.stat(os.path.join(root, file))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(root, file)))
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_bytes -= size
+    return None
@@ -0,0 +1,98 @@
+import numpy as np
+from ase import Atoms
+from ase.data import covalent_radii
+from typing import Tuple
+from ._povray_scene import get_view, get_atom_transmittances
+from ._povray_raster import to_pixels
+
+# POV-Ray 는 이미지 높이(Height)를 정수로 자르므로 세로 방향 pixel 위치가 화면 가장자리에서 최대 0.5 pixel 어긋날 수 있다
+CULL_MARGIN = 0.5
+# 원자 수만큼의 값을 갖는 POV-Ray 설정
+PER_ATOM_SETTINGS = ('colors', 'transmittances', 'textures')
+
+def get_pixel_distances(offset: int, fractions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # 원자 중심에서 (중심 pixel + offset) 번째 pixel 까지의 한 축 방향 최소/최대 거리. CULL_MARGIN 만큼 중심이 어긋나도 성립한다
+    low, high = offset - fractions, offset + 1 - fractions
+    near = np.where((low <= 0) & (high >= 0), 0.0, np.minimum(np.abs(low), np.abs(high)))
+    far = np.maximum(np.abs(low), np.abs(high))
+    return np.maximum(near - CULL_MARGIN, 0.0), far + CULL_MARGIN
+
+def get_hidden_atoms(atoms: Atoms, rotation_matrix: np.ndarray, canvas_width: int, opaque: np.ndarray) -> np.ndarray:
+    # 정사영에서 불투명한 원자들의 앞면이 원판 전체를 확실히 가리는 원자를 True 로 표시한다
+    radii = covalent_radii[atoms.numbers]
+    view = get_view(atoms, radii, rotation_matrix)
+    pixel_scale = canvas_width / view['width']
+    centers = to_pixels(atoms.get_positions(), rotation_matrix, view, pixel_scale)
+    pixel_radii = view['scale'] * radii * pixel_scale
+    fronts = centers[:, 2] + pixel_radii
+
+    n = int(np.ceil(pixel_radii.max() + CULL_MARGIN)) + 1
+    pad = n + 1
+    cols = np.floor(centers[:, 0]).astype(int)
+    rows = np.floor(centers[:, 1]).astype(int)
+    fraction_cols = centers[:, 0] - cols
+    fraction_rows = centers[:, 1] - rows
+    cols += pad
+    rows += pad
+    offsets = range(-n, n + 1)
+
+    # 1) 불투명한 원자가 완전히 덮는 pixel 마다 앞면 깊이의 하한 중 가장 앞의 값을 기록한다.
+    #    같은 pixel 에 중심이 있는 원자는 가장 앞의 것만 남겨서 한 번의 대입에 같은 pixel 이 두 번 나오지 않게 한다
+    depth = np.full((rows.max() + pad + 1, cols.max() + pad + 1), -np.inf)
+    occluders = np.flatnonzero(opaque)
+    occluders = occluders[np.lexsort((-centers[occluders, 2], cols[occluders], rows[occluders]))]
+    first = np.ones(len(occluders), dtype=bool)
+    first[1:] = (rows[occluders][1:] != rows[occluders][:-1]) | (cols[occluders][1:] != cols[occluders][:-1])
+    occluders = occluders[first]
+    radii2 = pixel_radii[occluders] ** 2
+    for dy in offsets:
+        _, far_y = get_pixel_distances(dy, fraction_rows[occluders])
+        for dx in offsets:
+            _, far_x = get_pixel_distances(dx, fraction_cols[occluders])
+            far2 = far_x ** 2 + far_y ** 2
+            covered = far2 <= radii2
+            if not covered.any():
+                continue
+            r, c = rows[occluders[covered]] + dy, cols[occluders[covered]] + dx
+            depth[r, c] = np.maximum(depth[r, c], centers[occluders[covered], 2] + np.sqrt(radii2[covered] - far2[covered]))
+
+    # 2) 원판이 닿는 모든 pixel 에서 기록된 깊이가 원자의 가장 앞보다 앞이면 가려진 것이다
+    hidden = np.ones(len(atoms), dtype=bool)
+    radii2 = pixel_radii ** 2
+    for dy in offsets:
+        near_y, _ = get_pixel_distances(dy, fraction_rows)
+        for dx in offsets:
+            near_x, _ = get_pixel_distances(dx, fraction_cols)
+            touched = near_x ** 2 + near_y ** 2 < radii2
+            hidden[touched] &= depth[rows[touched] + dy, cols[touched] + dx] > fronts[touched]
+
+    # 3) pixel 경계에 걸치는 부분 때문에 1) 2) 로는 알 수 없는, 같은 크기의 원자 바로 뒤에 있는 원자 (결정을 축 방향으로 볼 때)
+    #    같은 pixel 에 중심이 있는 가장 앞의 불투명한 원자가 모든 시선에서 먼저 닿으면 가려진 것이다
+    if len(occluders):
+        buckets = {(r, c): i for r, c, i in zip(rows[occluders], cols[occluders], occluders)}
+        for i in np.flatnonzero(~hidden):
+            j = buckets.get((rows[i], cols[i]))
+            if j is None or j == i:
+                continue
+            reach = np.linalg.norm(centers[i, :2] - centers[j, :2]) + pixel_radii[i]
+            if reach <= pixel_radii[j] and centers[j, 2] + np.sqrt(pixel_radii[j] ** 2 - reach ** 2) > fronts[i]:
+                hidden[i] = True
+    return hidden
+
+def cull_hidden_atoms(atoms: Atoms, rotation_matrix: np.ndarray, povray_settings: dict) -> Tuple[Atoms, dict]:
+    # 이 방향에서 보이지 않는 원자를 빼고, 원자별 설정(색, 투명도, texture)도 같이 자른다
+    transmittances = np.asarray(get_atom_transmittances(atoms, povray_settings), dtype=float)
+    hidden = get_hidden_atoms(atoms, rotation_matrix, povray_settings['canvas_width'], transmittances <= 0.0)
+    if not hidden.any():
+        return atoms, povray_settings
+    visible = np.flatnonzero(~hidden)
+    povray_settings = dict(povray_settings)
+    for key in PER_ATOM_SETTINGS:
+        values = povray_settings.get(key)
+        if values is None:
+            continue
+        if isinstance(values, np.ndarray):
+            povray_settings[key] = values[visible]
+        else:
+            povray_settings[key] = [values[i] for i in visible]
+    return atoms[visible], povray_settings
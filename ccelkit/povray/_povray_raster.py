@@ -0,0 +1,91 @@
+import numpy as np
+from ase import Atoms
+from ase.data import covalent_radii
+from PIL import Image
+from ._povray_scene import get_view, get_cell_edges, get_atom_colors, get_atom_transmittances, CELL_LINE_WIDTH
+
+# POV-Ray 의 area light 와 비슷하게 오른쪽 위 앞에서 비추는 빛
+LIGHT_DIRECTION = np.array([2., 3., 40.]) / np.linalg.norm([2., 3., 40.])
+AMBIENT = 0.4
+DIFFUSE = 0.6
+
+def get_rgb_colors(atoms: Atoms, povray_settings: dict) -> np.ndarray:
+    # colors 는 (r, g, b) 또는 POV-Ray 색 이름(str)일 수 있다. 이름은 회색으로 그린다
+    colors = get_atom_colors(atoms, povray_settings)
+    return np.array([(0.5, 0.5, 0.5) if isinstance(color, str) else tuple(color)[:3] for color in colors], dtype=float).reshape(-1, 3)
+
+def to_pixels(points: np.ndarray, rotation_matrix: np.ndarray, view: dict, pixel_scale: float) -> np.ndarray:
+    # 원자 좌표를 (열, 행, 깊이) pixel 좌표로 바꾼다. 깊이는 클수록 카메라에 가깝다
+    screen = view['scale'] * points @ rotation_matrix + view['translation']
+    return np.column_stack([(screen[:, 0] + view['width'] / 2) * pixel_scale,
+                            (view['height'] / 2 - screen[:, 1]) * pixel_scale,
+                            screen[:, 2] * pixel_scale])
+
+def draw_cell(canvas: np.ndarray, depth: np.ndarray, edges: np.ndarray, line_width: int) -> None:
+    # edges 는 pixel 좌표. 모서리 위의 점을 한 pixel 간격으로 찍는다. 원자보다 뒤에 있는 부분은 가려진다
+    height, width = depth.shape
+    for p1, p2 in edges:
+        length = int(np.ceil(np.linalg.norm(p2[:2] - p1[:2]))) + 1
+        points = p1 + np.linspace(0, 1, length)[:, None] * (p2 - p1)
+        for dx in range(-(line_width // 2), line_width - line_width // 2):
+            for dy in range(-(line_width // 2), line_width - line_width // 2):
+                cols = np.round(points[:, 0]).astype(int) + dx
+                rows = np.round(points[:, 1]).astype(int) + dy
+                inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+                cols, rows, z = cols[inside], rows[inside], points[inside, 2]
+                visible = z >= depth[rows, cols]
+                canvas[rows[visible], cols[visible]] = (0.0, 0.0, 0.0, 1.0)
+    return None
+
+def rasterize_atoms(atoms: Atoms, rotation_matrix: np.ndarray, povray_settings: dict) -> Image.Image:
+    # POV-Ray 없이 원자를 음영을 넣은 원판으로 그린다. 화면 구성은 POV-Ray 로 렌더링한 이미지와 같다
+    radii = covalent_radii[atoms.numbers]
+    view = get_view(atoms, radii, rotation_matrix)
+    canvas_width = int(povray_settings['canvas_width'])
+    canvas_height = int(canvas_width * view['height'] / view['width'])
+    pixel_scale = canvas_width / view['width']
+
+    # canvas 는 alpha 를 곱한 색 (premultiplied RGBA)
+    canvas = np.zeros((canvas_height, canvas_width, 4))
+    depth = np.full((canvas_height, canvas_width), -np.inf)
+    centers = to_pixels(atoms.get_positions(), rotation_matrix, view, pixel_scale)
+    pixel_radii = view['scale'] * radii * pixel_scale
+    colors = get_rgb_colors(atoms, povray_settings)
+    opacities = 1.0 - np.asarray(get_atom_transmittances(atoms, povray_settings), dtype=float)
+
+    # 뒤에 있는 원자부터 그린다
+    for i in np.argsort(centers[:, 2]):
+        x, y, z = centers[i]
+        r = pixel_radii[i]
+        col_min, col_max = max(int(x - r), 0), min(int(x + r) + 2, canvas_width)
+        row_min, row_max = max(int(y - r), 0), min(int(y + r) + 2, canvas_height)
+        if col_min >= col_max or row_min >= row_max:
+            continue
+        dx = (np.arange(col_min, col_max) + 0.5 - x) / r
+        dy = (np.arange(row_min, row_max) + 0.5 - y) / r
+        d2 = dx[None, :] ** 2 + dy[:, None] ** 2
+        inside = d2 <= 1.0
+        nz = np.sqrt(np.clip(1.0 - d2, 0.0, None))
+        sphere_depth = z + r * nz
+        region = depth[row_min:row_max, col_min:col_max]
+        visible = inside & (sphere_depth > region)
+        if not visible.any():
+            continue
+        shade = AMBIENT + DIFFUSE * np.clip(dx[None, :] * LIGHT_DIRECTION[0] - dy[:, None] * LIGHT_DIRECTION[1] + nz * LIGHT_DIRECTION[2], 0.0, None)
+        rgb = np.clip(shade[..., None] * colors[i], 0.0, 1.0)
+        alpha = opacities[i]
+        target = canvas[row_min:row_max, col_min:col_max]
+        target[visible, :3] = alpha * rgb[visible] + (1.0 - alpha) * target[visible, :3]
+        target[visible, 3] = alpha + (1.0 - alpha) * target[visible, 3]
+        if alpha >= 1.0:
+            region[visible] = sphere_depth[visible]
+
+    if atoms.cell.rank > 0:
+        edges = get_cell_edges(atoms)
+        pixel_edges = to_pixels(edges.reshape(-1, 3), rotation_matrix, view, pixel_scale).reshape(-1, 2, 3)
+        line_width = max(int(round(2 * CELL_LINE_WIDTH * view['scale'] * pixel_scale)), 1)
+        draw_cell(canvas, depth, pixel_edges, line_width)
+
+    # POV-Ray 와 같이 색에는 흰 배경을 섞고, 배경이 보이는 정도는 alpha 로 남긴다
+    canvas[..., :3] += 1.0 - canvas[..., 3:]
+    return Image.fromarray(np.round(np.clip(canvas, 0.0, 1.0) * 255).astype(np.uint8), 'RGBA')
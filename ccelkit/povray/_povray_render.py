@@ -0,0 +1,226 @@
+import os
+import tempfile
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from ase import Atoms
+from ase.io import write
+from PIL import Image
+from typing import List, Dict, Union, Iterable, Iterator, Callable, Tuple, Any
+from ._povray_utils import set_repeatation
+from ._povray_utils import set_cell_off
+from ._povray_utils import set_canvas_width
+from ._povray_utils import set_transmittances
+from ._povray_utils import set_heatmaps
+from ._povray_utils import set_camera_orientation
+from ._povray_utils import set_custom_colors
+from ._povray_utils import set_position_smoothing
+from ._povray_utils import set_preview
+from ._povray_utils import map_heatmap_colors
+from ._povray_utils import get_colormap
+from ._povray_utils import DEFAULT_COLORMAP, HEATMAP_ARRAY, TRANSMITTANCE_ARRAY
+from ._povray_cache import get_render_key, load_cached_image, save_cached_image
+from ._povray_scene import write_scene, write_scene_includes
+from ._povray_raster import rasterize_atoms
+from ._povray_cull import cull_hidden_atoms
+from ase.utils import rotate
+
+def get_povray_include_path() -> str:
+    povray_base_path = os.environ.get("POVRAY")
+    if not povray_base_path:
+        raise EnvironmentError("환경 변수 'POVRAY'가 설정되지 않았습니다.")
+    return os.path.join(povray_base_path, "include")
+
+def call_povray(scratch_dir: str, library_paths: List[str], antialias: bool = True) -> Image.Image:
+    # scratch_dir 안에서만 파일을 만들고 읽으므로 여러 프로세스가 동시에 실행해도 서로 덮어쓰지 않는다
+    povray_command = ['povray', '-D', *[f'+L{path}' for path in library_paths], 'frame.pov', 'frame.ini']
+    if not antialias:
+        # ini 파일보다 뒤에 있어야 ini 의 Antialias=True 를 덮어쓴다
+        povray_command.append('-A')
+    subprocess.run(povray_command, cwd=scratch_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    png_path = os.path.join(scratch_dir, 'frame.png')
+    if not os.path.exists(png_path):
+        raise RuntimeError(f"POV-Ray 가 이미지를 만들지 못했습니다. ({scratch_dir})")
+    with Image.open(png_path) as img:
+        img.load()
+        return img.copy()
+
+def run_povray(atoms: Atoms, rotation: str, povray_settings: dict, scratch_dir: str, library_paths: List[str], antialias: bool = True) -> Image.Image:
+    pov_path = os.path.join(scratch_dir, 'frame.pov')
+    write(pov_path, atoms, rotation=rotation, povray_settings=povray_settings)
+    return call_povray(scratch_dir, library_paths, antialias)
+
+def run_povray_scene(atoms: Atoms, rotation: str, povray_settings: dict, scratch_dir: str, scene_dir: str, library_paths: List[str]
+                     , includes: Union[Tuple[str, str], None] = None, antialias: bool = True) -> Image.Image:
+    # 원자 배치는 scene_dir 의 include 파일로 한 번만 쓰고, scratch_dir 에는 화면별 driver 만 쓴다
+    write_scene(atoms, rotation, povray_settings, scratch_dir, scene_dir, library_paths, includes)
+    return call_povray(scratch_dir, library_paths + [scene_dir], antialias)
+
+class RenderPlan:
+    # 입력 파일 하나를 렌더링하는 동안 바뀌지 않는 것(POV-Ray 설정, 카메라 회전, 캐시 키의 설정, include 경로)은 한 번만 계산한다.
+    # 프레임마다 하는 일은 위치에 따라 바뀌는 전처리(smoothing, 반복, cell)와 렌더링뿐이다
+    def __init__(self
+                 , repeatation: List[int]
+                 , orientations: List[List[float]]
+                 , cell_off: bool
+                 , transmittances: Union[List[float],None]
+                 , heatmaps: Union[List[float],None]
+                 , canvas_width: int
+                 , color_species: Union[Dict[str,List[float]],None]
+                 , color_index: Union[Dict[str,List[float]],None]
+                 , is_trajectory: bool = False
+                 , cache_dir: Union[str,None] = None
+                 , scene_dir: Union[str,None] = None
+                 , view_jobs: int = 1
+                 , preview: bool = False
+                 , raster: bool = False
+                 , colormap: str = DEFAULT_COLORMAP
+                 , heatmap_range: Union[List[float],None] = None
+                 , cull: bool = False):
+        self.repeatation = repeatation
+        self.cell_off = cell_off
+        self.color_species = color_species
+        self.color_index = color_index
+        self.is_trajectory = is_trajectory
+        self.colormap = colormap
+        self.heatmap_range = heatmap_range
+        self.cull = cull
+        self.cache_dir = cache_dir
+        self.view_jobs = view_jobs
+        # raster 는 항상 미리보기 품질이고 POV 장면 파일을 쓰지 않는다
+        self.preview = preview or raster
+        self.raster = raster
+        self.scene_dir = None if raster else scene_dir
+        # colormap 이름과 matplotlib 설치 여부는 worker 프로세스에 넘기기 전에 확인한다
+        if colormap != DEFAULT_COLORMAP:
+            get_colormap(colormap)
+
+        # POV-Ray 설정
+        self.povray_settings = {}
+        if is_trajectory:
+            self.povray_settings['background'] = 'White'
+        set_canvas_width(self.povray_settings, canvas_width)
+        set_transmittances(self.povray_settings, transmittances)
+        set_heatmaps(self.povray_settings, heatmaps, colormap, heatmap_range)
+
+        self.rotations = [set_camera_orientation(self.povray_settings, orientation) for orientation in orientations]
+        self.rotation_matrices = [rotate(rotation) for rotation in self.rotations]
+        self.library_paths = [] if raster else [get_povray_include_path()]
+
+        # 캐시 키에 들어가는 설정은 방향마다 하나
+        self.render_settings = []
+        for orientation in orientations:
+            render_settings = {'repeatation': repeatation, 'orientation': orientation, 'cell_off': cell_off,
+                               'transmittances': transmittances, 'heatmaps': heatmaps, 'canvas_width': canvas_width,
+                               'color_species': color_species, 'color_index': color_index, 'is_trajectory': is_trajectory}
+            if self.scene_dir is not None:
+                render_settings['scene'] = True
+            if self.preview:
+                render_settings['preview'] = True
+            if raster:
+                render_settings['raster'] = True
+            if colormap != DEFAULT_COLORMAP:
+                render_settings['colormap'] = colormap
+            if heatmap_range is not None:
+                render_settings['heatmap_range'] = heatmap_range
+            if cull:
+                render_settings['cull'] = True
+            self.render_settings.append(render_settings)
+
+        self.numbers_key = None
+        self.frame_settings = None
+
+    def prepare(self, atoms: Atoms) -> Tuple[Atoms, dict]:
+        atoms = set_position_smoothing(atoms)
+        atoms = set_repeatation(atoms, self.repeatation)
+        atoms = set_cell_off(atoms, self.cell_off)
+
+        # 색과 texture 는 원자 번호에만 의존하므로 원자 번호가 직전 프레임과 같으면 다시 계산하지 않는다
+        numbers_key = atoms.numbers.tobytes()
+        if numbers_key != self.numbers_key:
+            povray_settings = dict(self.povray_settings)
+            set_custom_colors(atoms, povray_settings, self.color_species, self.color_index)
+            set_preview(atoms, povray_settings, self.preview)
+            self.numbers_key = numbers_key
+            self.frame_settings = povray_settings
+        povray_settings = dict(self.frame_settings)
+
+        # 프레임마다 다른 원자별 값 (set_frame_values). 색은 고정 heatmap 과 같이 원소/index 별 색이 없을 때만 쓴다
+        if HEATMAP_ARRAY in atoms.arrays and not (self.color_species or self.color_index):
+            povray_settings['colors'] = map_heatmap_colors(atoms.arrays[HEATMAP_ARRAY], self.colormap, self.heatmap_range)
+        if TRANSMITTANCE_ARRAY in atoms.arrays:
+            povray_settings['transmittances'] = atoms.arrays[TRANSMITTANCE_ARRAY]
+        return atoms, povray_settings
+
+    def render_view(self, view_index: int, atoms: Atoms, povray_settings: dict, includes: Union[Tuple[str, str], None] = None) -> Image.Image:
+        rotation = self.rotations[view_index]
+        if self.cull:
+            # 이 방향에서 다른 원자에 완전히 가려지는 원자는 빼고 렌더링한다. 남는 원자가 방향마다 다르므로 장면 include 도 방향마다 쓴다
+            atoms, povray_settings = cull_hidden_atoms(atoms, self.rotation_matrices[view_index], povray_settings)
+            includes = None
+        if self.raster:
+            # POV-Ray 를 실행하지 않고 numpy 로 원판을 그린다
+            img = rasterize_atoms(atoms, self.rotation_matrices[view_index], povray_settings)
+        else:
+            with tempfile.TemporaryDirectory(prefix='ccelkit_povray_') as scratch_dir:
+                if self.scene_dir is None:
+                    img = run_povray(atoms, rotation, povray_settings, scratch_dir, self.library_paths, antialias=not self.preview)
+                else:
+                    img = run_povray_scene(atoms, rotation, povray_settings, scratch_dir, self.scene_dir, self.library_paths,
+                                           includes, antialias=not self.preview)
+
+        if self.is_trajectory:
+            # GIF 프레임은 흰 배경 위에 붙인 RGB 로 돌려준다 (프로세스 간 전달량도 줄어든다)
+            new_img = Image.new('RGBA', img.size, (255, 255, 255, 0))
+            new_img.paste(img, (0, 0))
+            img.close()
+            img = new_img.convert('RGB')
+            new_img.close()
+        return img
+
+    def __call__(self, atoms: Atoms, view_jobs: Union[int, None] = None) -> List[Image.Image]:
+        # 각 방향에서 본 이미지를 순서대로 돌려준다. 전처리(smoothing, 반복, 색 지정)는 한 번만 한다
+        if view_jobs is None:
+            view_jobs = self.view_jobs
+        images = [None] * len(self.rotations)
+        keys = [None] * len(self.rotations)
+        # cache_dir 가 주어지면 같은 구조/설정으로 렌더링한 이미지를 다시 사용한다
+        if self.cache_dir is not None:
+            for i, render_settings in enumerate(self.render_settings):
+                keys[i] = get_render_key(atoms, render_settings, (HEATMAP_ARRAY, TRANSMITTANCE_ARRAY))
+                images[i] = load_cached_image(self.cache_dir, keys[i])
+        missing = [i for i, img in enumerate(images) if img is None]
+        if not missing:
+            return images
+
+        atoms, povray_settings = self.prepare(atoms)
+        includes = None
+        if self.scene_dir is not None and not self.cull:
+            # 여러 방향을 동시에 렌더링해도 include 파일은 한 번만 쓰도록 미리 만든다
+            includes = write_scene_includes(atoms, povray_settings, self.scene_dir)
+        render = partial(self.render_view, atoms=atoms, povray_settings=povray_settings, includes=includes)
+        for i, img in zip(missing, map_frames(render, missing, view_jobs)):
+            images[i] = img
+            if self.cache_dir is not None:
+                save_cached_image(self.cache_dir, keys[i], img)
+        return images
+
+def map_frames(render: Callable[[Any], Any], frames: Iterable[Any], jobs: int = 1, max_in_flight: Union[int, None] = None) -> Iterator[Any]:
+    # 프레임(또는 방향) 순서를 유지하면서 jobs 개의 프로세스로 렌더링한다.
+    # frames 는 필요할 때만 읽고, 동시에 처리 중인 프레임은 max_in_flight 개를 넘지 않으므로 메모리 사용량이 프레임 수와 무관하다
+    if jobs <= 1:
+        for atoms in frames:
+            yield render(atoms)
+        return
+    if max_in_flight is None:
+        max_in_flight = 2 * jobs
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = deque()
+        for atoms in frames:
+            futures.append(executor.submit(render, atoms))
+            if len(futures) >= max_in_flight:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
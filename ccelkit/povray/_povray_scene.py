@@ -0,0 +1,251 @@
+import os
+import inspect
+import hashlib
+import tempfile
+import numpy as np
+from ase import Atoms
+from ase.data import covalent_radii
+from ase.data.colors import jmol_colors
+from ase.io.pov import POVRAY, pa, pc
+from ase.io.utils import PlottingVariables, get_cell_vertex_points, cell_to_lines
+from ase.utils import rotate
+from typing import Dict, List, Union, Any, Tuple
+
+SCENE_VERSION = 1
+
+def get_ase_default(func, name: str) -> Any:
+    # ase 가 상수 대신 인자의 기본값으로만 정해 두는 값. ase 의 기본값이 바뀌어도 ase 로 렌더링한 화면과 같게 유지된다
+    return inspect.signature(func).parameters[name].default
+
+# ase.io.utils.PlottingVariables / ase.io.pov.POVRAY 의 기본값
+MAX_WIDTH = float(get_ase_default(PlottingVariables.__init__, 'maxwidth'))
+BBOX_PADDING = float(get_ase_default(PlottingVariables.__init__, 'auto_bbox_size'))
+CAMERA_DISTANCE = float(get_ase_default(POVRAY.__init__, 'camera_dist'))
+CELL_LINE_WIDTH = float(get_ase_default(POVRAY.__init__, 'celllinewidth'))
+AREA_LIGHT = list(get_ase_default(POVRAY.__init__, 'area_light'))
+
+def get_scene_key(*arrays: np.ndarray) -> str:
+    sha256 = hashlib.sha256()
+    sha256.update(f"ccelkit-scene-{SCENE_VERSION}".encode())
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        sha256.update(f"{array.dtype.str}{array.shape}".encode())
+        sha256.update(array.tobytes())
+    return sha256.hexdigest()
+
+def get_cell_edges(atoms: Atoms) -> np.ndarray:
+    # ase 의 POVRAY.write_pov 와 같은 순서의 cell 모서리 (시작점, 끝점)
+    if atoms.cell.rank == 0:
+        return np.empty((0, 2, 3))
+    vertices = get_cell_vertex_points(atoms.cell, atoms.get_celldisp().flatten()).reshape(2, 2, 2, 3)
+    edges = []
+    for c in range(3):
+        for j in ([0, 0], [1, 0], [1, 1], [0, 1]):
+            p1 = vertices[tuple(j[:c]) + (0,) + tuple(j[c:])]
+            p2 = vertices[tuple(j[:c]) + (1,) + tuple(j[c:])]
+            if np.linalg.norm(p2 - p1) < 1e-12:
+                continue
+            edges.append((p1, p2))
+    return np.array(edges).reshape(-1, 2, 3)
+
+def get_view(atoms: Atoms, radii: np.ndarray, rotation_matrix: np.ndarray) -> Dict[str, Any]:
+    # PlottingVariables(scale=1, show_unit_cell=2) 와 같은 방법으로 화면 크기를 정하고,
+    # 원자 좌표를 POVRAY 의 화면 좌표로 옮기는 변환 (scale * R, translation) 을 돌려준다
+    positions = atoms.get_positions() @ rotation_matrix
+    bbox = np.array([(positions - radii[:, None]).min(0), (positions + radii[:, None]).max(0)])
+    front_points = positions
+    if atoms.cell.rank > 0:
+        vertices = get_cell_vertex_points(atoms.cell, atoms.get_celldisp().flatten()) @ rotation_matrix
+        bbox = np.array([np.minimum(bbox[0], vertices.min(0)), np.maximum(bbox[1], vertices.max(0))])
+        # POVRAY 는 cell 모서리 위의 점들까지 포함해서 가장 앞의 점을 정한다
+        front_points = np.concatenate([positions, cell_to_lines(None, atoms.cell.array)[0] @ rotation_matrix])
+
+    scale = 1.0
+    middle = bbox.mean(axis=0)
+    im_size = BBOX_PADDING * (bbox[1] - bbox[0])
+    if im_size[0] > MAX_WIDTH:
+        rescale_factor = MAX_WIDTH / im_size[0]
+        im_size *= rescale_factor
+        scale *= rescale_factor
+        middle *= rescale_factor
+    offset = middle - im_size / 2
+    offset[2] = bbox[1, 2]
+
+    # POVRAY 는 화면 중심을 x, y 의 원점으로, 가장 앞에 있는 점을 z 의 원점으로 둔다
+    z0 = (scale * front_points[:, 2] - offset[2]).max()
+    translation = -offset - np.array([im_size[0] / 2, im_size[1] / 2, z0])
+    return {'scale': scale, 'rotation': rotation_matrix, 'translation': translation,
+            'width': im_size[0], 'height': im_size[1]}
+
+def format_vectors(vectors: np.ndarray) -> str:
+    vectors = np.asarray(vectors, dtype=float).reshape(-1, 3)
+    return ('<%.4f, %.4f, %.4f>,\n' * len(vectors) % tuple(vectors.ravel())).rstrip(',\n')
+
+def format_scalars(values: np.ndarray) -> str:
+    values = np.asarray(values, dtype=float).ravel()
+    return ('%.4f, ' * len(values) % tuple(values)).rstrip(', ')
+
+def write_scene_geometry(geometry_path: str, atoms: Atoms, radii: np.ndarray) -> None:
+    # 원자/cell 의 위치는 회전하지 않은 원자 좌표 그대로 기록한다. 화면 방향은 driver 의 matrix 가 정한다
+    cell_edges = get_cell_edges(atoms)
+    lines = ["// ccelkit scene geometry",
+             f"#declare N_ATOMS = {len(atoms)};",
+             f"#declare ATOM_LOC = array[{len(atoms)}] {{\n{format_vectors(atoms.get_positions())}\n}}",
+             f"#declare ATOM_R = array[{len(atoms)}] {{{format_scalars(radii)}}}",
+             f"#declare N_CELL_EDGES = {len(cell_edges)};"]
+    if len(cell_edges):
+        lines += [f"#declare CELL_EDGE_A = array[{len(cell_edges)}] {{\n{format_vectors(cell_edges[:, 0])}\n}}",
+                  f"#declare CELL_EDGE_B = array[{len(cell_edges)}] {{\n{format_vectors(cell_edges[:, 1])}\n}}"]
+    write_scene_file(geometry_path, "\n".join(lines) + "\n")
+    return None
+
+def write_scene_appearance(appearance_path: str, colors: list, transmittances: list) -> None:
+    lines = ["// ccelkit scene appearance",
+             f"#declare ATOM_COL = array[{len(colors)}] {{\n" + ",\n".join(pc(color) for color in colors) + "\n}",
+             f"#declare ATOM_TRANS = array[{len(transmittances)}] {{{format_scalars(transmittances)}}}"]
+    write_scene_file(appearance_path, "\n".join(lines) + "\n")
+    return None
+
+def write_scene_file(path: str, text: str) -> None:
+    # 다른 프로세스가 같은 파일을 읽고 있을 수 있으므로 임시 파일에 쓴 다음 바꿔치기한다
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+    return None
+
+def get_scene_file(scene_dir: str, name: str, key: str) -> str:
+    path = os.path.join(scene_dir, f"{name}_{key[:32]}.inc")
+    if os.path.exists(path):
+        # LRU 정리를 위해 사용한 시각을 갱신한다
+        os.utime(path)
+    return path
+
+def get_atom_colors(atoms: Atoms, povray_settings: dict) -> list:
+    colors = povray_settings.get('colors')
+    if colors is None:
+        return [tuple(color) for color in jmol_colors[atoms.numbers.clip(max=len(jmol_colors) - 1)]]
+    return [colors[i] for i in range(len(atoms))]
+
+def get_atom_transmittances(atoms: Atoms, povray_settings: dict) -> list:
+    transmittances = povray_settings.get('transmittances')
+    if transmittances is None:
+        return [0.0] * len(atoms)
+    if len(transmittances) < len(atoms):
+        raise ValueError(f"transmittances 의 길이({len(transmittances)})가 원자 수({len(atoms)})보다 작습니다.")
+    return list(transmittances[:len(atoms)])
+
+def write_scene_driver(pov_path: str, geometry_name: str, appearance_name: str, view: Dict[str, Any], povray_settings: dict, has_cell: bool) -> None:
+    scale = view['scale']
+    matrix = np.vstack([scale * view['rotation'], view['translation']])
+    matrix = ", ".join(f"{value:.6f}" for value in matrix.ravel())
+
+    background = povray_settings.get('background', 'White')
+    mat_style_keys = "\n".join(f'#declare {k} = {v}' for k, v in POVRAY.material_styles_dict.items())
+    # ccelkit 은 모든 원자에 같은 texture 를 쓴다 (미리보기는 simple)
+    textures = povray_settings.get('textures')
+    texture = textures[0] if textures else 'ase3'
+
+    lights = "\n".join(f"light_source {{{pa(loc)} {pc(rgb)}}}" for loc, rgb in povray_settings.get('point_lights', []))
+    area_light = povray_settings.get('area_light', AREA_LIGHT)
+    if area_light is not None:
+        loc, color, width, height, nx, ny = area_light
+        lights += f"""\nlight_source {{{pa(loc)} {pc(color)}
+  area_light <{width:.2f}, 0, 0>, <0, {height:.2f}, 0>, {nx:n}, {ny:n}
+  adaptive 1 jitter}}"""
+
+    # union 전체에 matrix 가 적용되어 크기가 scale 배가 되므로 cell 선 두께(Rcell)는 미리 scale 로 나눈다
+    cell_loop = ""
+    if has_cell:
+        cell_loop = """  #declare I = 0;
+  #while (I < N_CELL_EDGES)
+    cylinder {CELL_EDGE_A[I], CELL_EDGE_B[I], Rcell pigment {Black}}
+    #declare I = I + 1;
+  #end
+"""
+    pov = f"""#version 3.6;
+#include "colors.inc"
+#include "finish.inc"
+
+global_settings {{assumed_gamma 2.2 max_trace_level 6}}
+background {{{pc(background)} transmit 1.0}}
+camera {{orthographic
+  right -{view['width']:.2f}*x up {view['height']:.2f}*y
+  direction 1.00*z
+  location <0,0,{CAMERA_DISTANCE:.2f}> look_at <0,0,0>}}
+{lights}
+// no fog
+{mat_style_keys}
+#declare Rcell = {CELL_LINE_WIDTH / scale:.4f};
+
+#macro atom(LOC, R, COL, TRANS, FIN)
+  sphere{{LOC, R texture{{pigment{{color COL transmit TRANS}} finish{{FIN}}}}}}
+#end
+
+#include "{geometry_name}"
+#include "{appearance_name}"
+
+union {{
+{cell_loop}  #declare I = 0;
+  #while (I < N_ATOMS)
+    atom(ATOM_LOC[I], ATOM_R[I], ATOM_COL[I], ATOM_TRANS[I], {texture})
+    #declare I = I + 1;
+  #end
+  matrix <{matrix}>
+}}
+"""
+    with open(pov_path, 'w') as f:
+        f.write(pov)
+    return None
+
+def write_scene_ini(ini_path: str, pov_name: str, view: Dict[str, Any], canvas_width: int, library_paths: List[str]) -> None:
+    canvas_height = canvas_width / (view['width'] / view['height'])
+    ini = f"""Input_File_Name={pov_name}
+Output_to_File=True
+Output_File_Type=N
+Output_Alpha=on
+; if you adjust Height, and width, you must preserve the ratio
+; Width / Height = {canvas_width / canvas_height:f}
+Width={canvas_width}
+Height={canvas_height}
+Antialias=True
+Antialias_Threshold=0.1
+Display=False
+Display_Gamma=sRGB
+Pause_When_Done=True
+Verbose=False
+"""
+    ini += "".join(f'Library_Path="{path}"\n' for path in library_paths)
+    with open(ini_path, 'w') as f:
+        f.write(ini)
+    return None
+
+def write_scene_includes(atoms: Atoms, povray_settings: dict, scene_dir: str) -> Tuple[str, str]:
+    # 원자 위치(geometry)와 색/투명도(appearance)는 scene_dir 에 한 번만 쓰고 다시 사용한다
+    os.makedirs(scene_dir, exist_ok=True)
+    radii = covalent_radii[atoms.numbers]
+    geometry_key = get_scene_key(atoms.numbers, atoms.get_positions(), atoms.cell.array, atoms.get_celldisp(), radii)
+    geometry_path = get_scene_file(scene_dir, 'geometry', geometry_key)
+    if not os.path.exists(geometry_path):
+        write_scene_geometry(geometry_path, atoms, radii)
+
+    colors = get_atom_colors(atoms, povray_settings)
+    transmittances = get_atom_transmittances(atoms, povray_settings)
+    appearance_key = get_scene_key(np.array([pc(color) for color in colors]), np.array(transmittances, dtype=float))
+    appearance_path = get_scene_file(scene_dir, 'appearance', appearance_key)
+    if not os.path.exists(appearance_path):
+        write_scene_appearance(appearance_path, colors, transmittances)
+    return geometry_path, appearance_path
+
+def write_scene(atoms: Atoms, rotation: Union[str, np.ndarray], povray_settings: dict, scratch_dir: str, scene_dir: str, library_paths: List[str]
+                , includes: Union[Tuple[str, str], None] = None) -> str:
+    # 화면마다 바뀌는 카메라/변환만 scratch_dir 의 작은 driver .pov 에 쓴다. includes 는 이미 쓴 (geometry, appearance) 경로
+    if includes is None:
+        includes = write_scene_includes(atoms, povray_settings, scene_dir)
+    geometry_path, appearance_path = includes
+    rotation_matrix = rotate(rotation) if isinstance(rotation, str) else np.asarray(rotation, dtype=float)
+    view = get_view(atoms, covalent_radii[atoms.numbers], rotation_matrix)
+    pov_path = os.path.join(scratch_dir, 'frame.pov')
+    write_scene_driver(pov_path, os.path.basename(geometry_path), os.path.basename(appearance_path), view, povray_settings, atoms.cell.rank > 0)
+    write_scene_ini(os.path.join(scratch_dir, 'frame.ini'), 'frame.pov', view, povray_settings['canvas_width'], library_paths + [scene_dir])
+    return pov_path
@@ -1,13 +1,15 @@
 from ase.io import read, write
 from ase import Atoms
-from typing import List, Union, Dict
+from typing import List, Union, Dict, Iterable, Iterator, Tuple
 import os
 import numpy as np
 from ase.data.colors import jmol_colors
+from ase.data import atomic_numbers
 
 from scipy.spatial.transform import Rotation as R
 import os
 import yaml
+from fnmatch import fnmatch
 
 def set_postfix(filepath: str) -> str:
     if '.' in filepath:
@@ -27,10 +29,15 @@ def create_config():
         "input_filepath": None, # if target is specified, input_filepath must be None value
         "output_filepath": None, # if target is specified, output_filepath must be None value
         "repeatation": [1, 1, 1], # 3x1 array
-        "orientation": "perspective", # "top", "side_x", "side_y", "perspective" or vesta orientation 3x3 array
+        "orientation": "perspective", # "top", "side_x", "side_y", "perspective" or vesta orientation 3x3 array, or a list of them
+        "contact_sheet": False, # when several orientations are given, also tile all views into the output image
         "cell_off": False, # true or false
         "transmittances": None, # array of float, 1 : 100% transmittance, 0 : 0% transmittance
         "heatmaps": None, # array of float, 1 : 100% red, 0 : 100% blue
+        "heatmap_source": None, # per frame heatmaps: .npy file (atoms or frames x atoms) or a per-atom value stored in the trajectory (forces, charges, magmoms, ...)
+        "transmittance_source": None, # per frame transmittances, same form as heatmap_source
+        "colormap": "redblue", # "redblue" or a matplotlib colormap name
+        "heatmap_range": None, # [min, max] mapped to the ends of the colormap, None : values are already 0 ~ 1
         "canvas_width": 800, # pixel number of canvas width
         "color_species": {
             # "Re": [0.580, 0, 0.827],
@@ -45,13 +52,32 @@ def create_config():
             # 3: [0.0, 0.0, 1.0]
         },
         "frame_per_second": 24,
-        "postfix": ""
+        "postfix": "",
+        "jobs": 1, # number of frames rendered in parallel, 0 : all cores
+        "frames": None, # "start:stop:step" frames of the trajectory to render, None : all frames
+        "rmsd_threshold": None, # skip frames whose RMSD (angstrom) from the last rendered frame is below this value
+        "cache": True, # reuse images rendered with the same structure and settings
+        "reuse_scene": False, # write atom geometry once into a POV include file and reuse it for every view
+        "preview": False, # small, non-antialiased thumbnails with simple textures
+        "raster": False, # draw shaded discs with numpy instead of running POV-Ray (implies preview)
+        "cull": False, # drop atoms fully hidden behind opaque atoms in each view (large supercells)
+        "workers": 1, # number of target files rendered in parallel, 0 : all cores
+        "max_depth": None, # how deep the target search descends into sub directories, 0 : current directory only, None : no limit
+        "include": None, # glob patterns (file name or relative path) the target files must match, e.g. ["*CONTCAR*"]
+        "exclude": None # glob patterns of files or directories to skip, e.g. ["*_relax", "run_*"]
     }
     
     # YAML 파일로 저장
     with open("./config.yml", 'w', encoding='utf-8') as f:
         yaml.dump(default_config, f, allow_unicode=True, default_flow_style=False)
 
+ORIENTATION_PRESETS = ["top", "side_x", "side_y", "perspective"]
+PREVIEW_WIDTH = 320
+DEFAULT_COLORMAP = "redblue"
+# 프레임마다 다른 원자별 값은 atoms.arrays 에 넣어서 넘긴다 (반복하면 같이 반복된다)
+HEATMAP_ARRAY = "ccelkit_heatmaps"
+TRANSMITTANCE_ARRAY = "ccelkit_transmittances"
+
 def parse_orientation(orientation: str) -> List[float]:
     orientation_preset = {
         "top": "+1.000000 +0.000000 +0.000000 +0.000000 +1.000000 +0.000000 +0.000000 +0.000000 +1.000000",
@@ -65,6 +91,89 @@ def parse_orientation(orientation: str) -> List[float]:
     orientation = [float(o) for o in orientation]
     return orientation
 
+def is_number(value) -> bool:
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def parse_orientations(orientation: Union[str, List]) -> List[Tuple[str, List[float]]]:
+    # orientation 을 (이름, 3x3 행렬을 편 9개의 숫자) 의 list 로 바꾼다
+    # - "top" 같은 preset 이름 또는 9개의 숫자로 된 문자열 하나
+    # - 숫자 9개의 list (-ori 로 숫자를 따로 넘기거나 config 에 list 로 적은 경우) 는 행렬 하나
+    # - 그 외의 list 는 각 원소가 하나의 방향 (preset 이름, 숫자 문자열, 숫자 9개의 list)
+    if orientation is None:
+        orientation = "perspective"
+    if isinstance(orientation, str):
+        orientation = [orientation]
+    orientation = list(orientation)
+    if len(orientation) == 9 and all(is_number(o) for o in orientation):
+        orientation = [" ".join(str(o) for o in orientation)]
+
+    views = []
+    for i, view in enumerate(orientation):
+        if isinstance(view, str) and view.strip() in ORIENTATION_PRESETS:
+            name = view.strip()
+        else:
+            name = f"view{i}"
+        if not isinstance(view, str):
+            view = " ".join(str(o) for o in view)
+        matrix = parse_orientation(view.strip())
+        if len(matrix) != 9:
+            raise ValueError(f"orientation 은 preset 이름 또는 9개의 숫자여야 합니다. ({view})")
+        views.append((name, matrix))
+    return views
+
+def get_view_filepaths(output_filepath: str, view_names: List[str]) -> List[str]:
+    # 방향이 여러 개이면 출력 파일 이름 뒤에 방향 이름을 붙인다
+    if len(view_names) == 1:
+        return [output_filepath]
+    file_name, extension = os.path.splitext(output_filepath)
+    return [f"{file_name}_{name}{extension}" for name in view_names]
+
+def match_patterns(name: str, relpath: str, patterns: Union[List[str], None]) -> bool:
+    # glob 패턴은 파일/폴더 이름 또는 시작 폴더 기준 상대 경로 중 하나와 맞으면 된다
+    if not patterns:
+        return False
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    return any(fnmatch(name, pattern) or fnmatch(relpath, pattern) for pattern in patterns)
+
+def find_target_files(target: str
+                      , postfix: str = ""
+                      , start_dir: str = '.'
+                      , max_depth: Union[int, None] = None
+                      , include: Union[List[str], None] = None
+                      , exclude: Union[List[str], None] = None) -> List[Tuple[str, str]]:
+    # 이름에 target 이 들어간 파일과 저장할 이미지 경로의 목록. max_depth 보다 깊은 폴더와 exclude 에 맞는 폴더는 들어가지 않는다
+    targets = []
+    for root, dirs, files in os.walk(start_dir):
+        relroot = os.path.relpath(root, start_dir)
+        depth = 0 if relroot == '.' else relroot.count(os.sep) + 1
+        if max_depth is not None and depth >= max_depth:
+            dirs[:] = []
+        else:
+            dirs[:] = sorted(d for d in dirs if not match_patterns(d, os.path.normpath(os.path.join(relroot, d)), exclude))
+        for file in sorted(files):
+            if target not in file or file.startswith('img_'):
+                continue
+            relpath = os.path.normpath(os.path.join(relroot, file))
+            if include and not match_patterns(file, relpath, include):
+                continue
+            if match_patterns(file, relpath, exclude):
+                continue
+            file_path = os.path.abspath(os.path.join(root, file))
+
+            if '.' in file:
+                file_name, _ = os.path.splitext(file)
+            else:
+                file_name = file
+            new_file_name = set_postfix(file_name + postfix)
+            new_file_path = os.path.abspath(os.path.join(root, new_file_name))
+            targets.append((file_path, new_file_path))
+    return targets
+
 def set_repeatation(atoms: Atoms, repeatation: list) -> Atoms:
     atoms = atoms.repeat(repeatation)
     return atoms
@@ -80,14 +189,56 @@ def set_canvas_width(povray_settings: dict, canvas_width: int) -> None:
     povray_settings.update(new_instance)
     return None
 
+def set_preview(atoms: Atoms, povray_settings: dict, preview: bool) -> None:
+    # 미리보기: 작은 이미지, 단순한 texture, area light 대신 점광원 하나
+    if preview:
+        povray_settings.update({'canvas_width': min(povray_settings['canvas_width'], PREVIEW_WIDTH),
+                                'textures': ['simple'] * len(atoms),
+                                'area_light': None,
+                                'point_lights': [((2., 3., 40.), 'White')]})
+    return None
+
 def set_transmittances(povray_settings: dict, transmittances: Union[List[float],None]) -> None:
     if transmittances:
         povray_settings.update({'transmittances': transmittances})
     return None
 
-def set_heatmaps(povray_settings: dict, heatmaps: Union[List[float],None]) -> None:
+def get_colormap(colormap: str):
+    try:
+        import matplotlib
+    except ImportError:
+        raise ImportError(f"colormap '{colormap}' 에는 matplotlib 이 필요합니다. 'pip install ccelkit[colormap]' 으로 설치하세요.")
+    try:
+        from matplotlib import colormaps
+    except ImportError:
+        # matplotlib 3.5 미만에는 colormaps 가 없다
+        import matplotlib.cm
+        try:
+            return matplotlib.cm.get_cmap(colormap)
+        except ValueError:
+            raise ValueError(f"지원하지 않는 colormap 입니다. ({colormap})")
+    if colormap not in colormaps:
+        raise ValueError(f"지원하지 않는 colormap 입니다. ({colormap})")
+    return colormaps[colormap]
+
+def map_heatmap_colors(values: np.ndarray, colormap: str = DEFAULT_COLORMAP, value_range: Union[List[float], None] = None) -> np.ndarray:
+    # 원자별 값을 (N, 3) RGB 로 바꾼다. value_range 가 없으면 0~1 사이로 자른다
+    values = np.asarray(values, dtype=float)
+    if value_range is not None:
+        vmin, vmax = value_range
+        if vmax == vmin:
+            raise ValueError(f"heatmap_range 의 최솟값과 최댓값이 같습니다. ({vmin})")
+        values = (values - vmin) / (vmax - vmin)
+    values = np.clip(values, 0.0, 1.0)
+    if colormap == DEFAULT_COLORMAP:
+        # 1 : 100% red, 0 : 100% blue
+        return np.column_stack([values, np.zeros_like(values), 1.0 - values])
+    return get_colormap(colormap)(values)[:, :3]
+
+def set_heatmaps(povray_settings: dict, heatmaps: Union[List[float],None]
+                 , colormap: str = DEFAULT_COLORMAP, value_range: Union[List[float], None] = None) -> None:
     if heatmaps:
-        mapped_colors = [(c, 0.0, 1.0 - c) for c in heatmaps]
+        mapped_colors = map_heatmap_colors(heatmaps, colormap, value_range)
         povray_settings.update({'colors': mapped_colors})
     return None
 
@@ -103,40 +254,136 @@ def set_custom_colors(atoms: Atoms, povray_settings: dict
     if (not color_species_dict) and (not color_index_dict):
         return None
 
-    colors = povray_settings.get('colors', [0.0 for _ in range(len(atoms))])
-    if not color_species_dict:
-        color_species_dict = {}
-    if not color_index_dict:
-        color_index_dict = {}
-
-    for i, atom in enumerate(atoms):
-        default_color = color_species_dict.get(atom.symbol,jmol_colors[atom.number])
-        colors[i] = color_index_dict.get(i,default_color)
+    # 기본은 jmol 색, 원소별 색, 원자 index 별 색 순서로 덮어쓴다
+    numbers = atoms.numbers
+    colors = np.array(jmol_colors[numbers.clip(max=len(jmol_colors) - 1)], dtype=float)
+    for symbol, color in (color_species_dict or {}).items():
+        # 원소 기호가 아닌 이름 (오타, 소문자 등) 은 이전처럼 무시한다
+        if symbol not in atomic_numbers:
+            continue
+        colors[numbers == atomic_numbers[symbol]] = color
+    for index, color in (color_index_dict or {}).items():
+        if 0 <= int(index) < len(atoms):
+            colors[int(index)] = color
     povray_settings.update({'colors': colors})
     return None
 
 def set_position_smoothing(atoms: Atoms) -> Atoms:
+    # cell 의 끝(scaled 좌표 0.99 초과)에 걸친 원자를 반대쪽으로 옮긴다. 기울어진 cell 에서도 맞도록 scaled 좌표로 판단한다
     atoms_copied = atoms.copy()
-    cell = atoms_copied .get_cell()
-    a, b, c = cell[0], cell[1], cell[2]
-
-    positions = atoms_copied.get_positions()
-
-    limit_a = 0.99 * np.linalg.norm(a)
-    limit_b = 0.99 * np.linalg.norm(b)
-    limit_c = 0.99 * np.linalg.norm(c)
-
-    for i, pos in enumerate(positions):
-        if pos[0] > limit_a:
-            positions[i] -= a
-        if pos[1] > limit_b:
-            positions[i] -= b
-        if pos[2] > limit_c:
-            positions[i] -= c
-
-    atoms_copied.set_positions(positions)
+    if atoms_copied.cell.rank < 3:
+        return atoms_copied
+    scaled_positions = atoms_copied.get_scaled_positions(wrap=False)
+    shifts = (scaled_positions > 0.99).astype(float)
+    atoms_copied.positions -= shifts @ atoms_copied.cell.array
     return atoms_copied
 
 def set_duration(frame_per_second: int) -> int:
     duration = int(1000 / frame_per_second)  # ms = 1000ms/s * (1s/fps)
     return duration
+
+def parse_frames(frames: Union[str, int, None]) -> Union[slice, int]:
+    # "start:stop:step" (python slice 와 같은 규칙) 또는 정수 하나
+    if frames is None:
+        return slice(None)
+    if isinstance(frames, int):
+        return frames
+    try:
+        fields = [None if field.strip() == '' else int(field) for field in str(frames).split(':')]
+    except ValueError:
+        raise ValueError(f"frames 는 'start:stop:step' 형식이어야 합니다. ({frames})")
+    if len(fields) == 1 and fields[0] is not None:
+        return fields[0]
+    if not 2 <= len(fields) <= 3:
+        raise ValueError(f"frames 는 'start:stop:step' 형식이어야 합니다. ({frames})")
+    if len(fields) == 3 and fields[2] == 0:
+        raise ValueError("frames 의 step 은 0 이 될 수 없습니다.")
+    return slice(*fields)
+
+def get_rmsd(atoms: Atoms, reference: Atoms) -> float:
+    # 주기 경계를 넘어간 원자가 큰 변위로 계산되지 않도록 minimum image 로 계산한다
+    displacements = atoms.get_positions() - reference.get_positions()
+    if atoms.cell.rank == 3:
+        scaled = np.linalg.solve(atoms.cell.T, displacements.T).T
+        scaled -= np.round(scaled)
+        displacements = scaled @ atoms.cell.array
+    return float(np.sqrt((displacements ** 2).sum(axis=1).mean()))
+
+def skip_similar_frames(frames: Iterable[Atoms], rmsd_threshold: Union[float, None]) -> Iterator[Atoms]:
+    # 마지막으로 렌더링한 프레임과의 RMSD 가 rmsd_threshold 보다 작은 프레임은 건너뛴다
+    reference = None
+    for atoms in frames:
+        if (rmsd_threshold is None or reference is None or len(atoms) != len(reference)
+                or get_rmsd(atoms, reference) >= rmsd_threshold):
+            reference = atoms
+            yield atoms
+
+def load_atom_values(source: Union[str, None]) -> Union[np.ndarray, str, None]:
+    # .npy 파일은 memory map 으로 열어 필요한 프레임(행)만 읽는다. 그 외의 문자열은 각 프레임에 저장된 값의 이름 (forces, charges, magmoms, ...)
+    if source is None:
+        return None
+    if source.endswith('.npy'):
+        values = np.load(source, mmap_mode='r')
+        if values.ndim not in (1, 2):
+            raise ValueError(f"원자별 값 배열은 (원자) 또는 (프레임 x 원자) 모양이어야 합니다. ({source}: {values.shape})")
+        return values
+    return source
+
+def get_value_range(values: Union[np.ndarray, str, None]) -> Union[List[float], None]:
+    # .npy 의 모든 프레임에서의 최솟값/최댓값. 프레임마다 같은 값이 같은 색이 되도록 heatmap_range 대신 사용한다
+    if not isinstance(values, np.ndarray):
+        return None
+    vmin, vmax = float(np.nanmin(values)), float(np.nanmax(values))
+    return [vmin, vmax] if vmax > vmin else None
+
+def get_atom_values(atoms: Atoms, name: str) -> np.ndarray:
+    # atoms.arrays 또는 계산 결과(.traj 의 forces, charges, magmoms 등)에서 값을 찾는다. 벡터 값은 크기를 사용한다
+    if name in atoms.arrays:
+        values = atoms.arrays[name]
+    elif atoms.calc is not None and name in atoms.calc.results:
+        values = atoms.calc.results[name]
+    else:
+        raise ValueError(f"구조에 '{name}' 값이 없습니다.")
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 2:
+        values = np.linalg.norm(values, axis=1)
+    return values
+
+def set_frame_values(frames: Iterable[Atoms], index: Union[slice, int]
+                     , heatmap_values: Union[np.ndarray, str, None] = None
+                     , transmittance_values: Union[np.ndarray, str, None] = None) -> Iterator[Atoms]:
+    # 각 프레임의 원자별 heatmap/투명도 값을 atoms.arrays 에 넣는다. (프레임 x 원자) 배열은 index 로 고른 프레임의 행만 읽는다
+    sources = [(name, values) for name, values in ((HEATMAP_ARRAY, heatmap_values), (TRANSMITTANCE_ARRAY, transmittance_values)) if values is not None]
+    if not sources:
+        yield from frames
+        return
+    frame_numbers = None
+    num_rows = {len(values) for _, values in sources if isinstance(values, np.ndarray) and values.ndim == 2}
+    if len(num_rows) > 1:
+        raise ValueError(f"heatmap 과 투명도 배열의 프레임 수가 다릅니다. ({sorted(num_rows)})")
+    if num_rows:
+        num_frames = num_rows.pop()
+        frame_numbers = iter(range(*index.indices(num_frames)) if isinstance(index, slice) else [range(num_frames)[index]])
+
+    for atoms in frames:
+        frame = None
+        if frame_numbers is not None:
+            frame = next(frame_numbers, None)
+            if frame is None:
+                raise ValueError("궤적의 프레임 수가 원자별 값 배열의 프레임 수보다 많습니다.")
+        arrays = {}
+        for name, values in sources:
+            if isinstance(values, str):
+                frame_values = get_atom_values(atoms, values)
+            elif values.ndim == 1:
+                frame_values = np.array(values, dtype=float)
+            else:
+                frame_values = np.array(values[frame], dtype=float)
+            if len(frame_values) != len(atoms):
+                raise ValueError(f"원자별 값의 개수({len(frame_values)})가 원자 수({len(atoms)})와 다릅니다.")
+            arrays[name] = frame_values
+        # 넘겨받은 Atoms 는 바꾸지 않는다 (copy 는 계산 결과를 버리므로 값을 먼저 읽는다)
+        atoms = atoms.copy()
+        for name, frame_values in arrays.items():
+            atoms.set_array(name, frame_values)
+        yield atoms
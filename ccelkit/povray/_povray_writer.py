@@ -0,0 +1,170 @@
+import os
+import math
+import shutil
+import tempfile
+import subprocess
+from PIL import Image, ImageChops, GifImagePlugin
+from typing import List, Union
+from ._povray_utils import set_duration
+
+VIDEO_CODECS = {
+    '.mp4': ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', '18', '-movflags', '+faststart'],
+    '.mov': ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', '18'],
+    '.mkv': ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-crf', '18'],
+    '.webm': ['-c:v', 'libvpx-vp9', '-pix_fmt', 'yuv420p', '-crf', '30', '-b:v', '0'],
+}
+
+class GifWriter:
+    # 프레임을 받는 즉시 GIF 파일에 기록한다. 같은 프레임이 연속되면 합쳐야 하므로 직전 프레임 하나만 들고 있는다
+    def __init__(self, output_filepath: str, duration: int, loop: int = 0, disposal: int = 2):
+        self.output_filepath = output_filepath
+        self.duration = duration
+        self.loop = loop
+        self.disposal = disposal
+        self.file = None
+        self.num_frames = 0
+        self.pending: Union[Image.Image, None] = None
+        self.pending_duration = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def write(self, img: Image.Image) -> None:
+        img = img.convert('RGB')
+        if self.pending is not None and ImageChops.difference(self.pending, img).getbbox() is None:
+            self.pending_duration += self.duration
+            return None
+        self._flush()
+        self.pending = img
+        self.pending_duration = self.duration
+        return None
+
+    def _flush(self) -> None:
+        if self.pending is None:
+            return None
+        frame = self.pending.convert('P', palette=Image.Palette.ADAPTIVE)
+        info = {'optimize': True, 'loop': self.loop, 'duration': self.pending_duration}
+        # getheader 는 frame 의 palette 를 사용하는 색만 남도록 정리한다 (Pillow 의 save_all 과 같은 결과)
+        header, _ = GifImagePlugin.getheader(frame, info=info)
+        params = {'duration': self.pending_duration, 'disposal': self.disposal}
+        if self.file is None:
+            self.file = open(self.output_filepath, 'wb')
+            for s in header:
+                self.file.write(s)
+        else:
+            params['include_color_table'] = True
+        for s in GifImagePlugin.getdata(frame, (0, 0), **params):
+            self.file.write(s)
+        self.num_frames += 1
+        self.pending.close()
+        self.pending = None
+        return None
+
+    def close(self) -> None:
+        self._flush()
+        if self.file is not None:
+            self.file.write(b';')
+            self.file.close()
+            self.file = None
+        return None
+
+def make_contact_sheet(images: List[Image.Image], columns: Union[int, None] = None) -> Image.Image:
+    # 여러 방향의 이미지를 격자로 붙인다. 각 칸의 크기는 가장 큰 이미지에 맞추고 이미지는 칸의 가운데에 둔다
+    if columns is None:
+        columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    cell_width = max(img.width for img in images)
+    cell_height = max(img.height for img in images)
+    mode = 'RGBA' if any(img.mode == 'RGBA' for img in images) else 'RGB'
+    background = (255, 255, 255, 0) if mode == 'RGBA' else (255, 255, 255)
+    sheet = Image.new(mode, (columns * cell_width, rows * cell_height), background)
+    for i, img in enumerate(images):
+        row, column = divmod(i, columns)
+        x = column * cell_width + (cell_width - img.width) // 2
+        y = row * cell_height + (cell_height - img.height) // 2
+        sheet.paste(img.convert(mode), (x, y))
+    return sheet
+
+def get_ffmpeg_path() -> str:
+    # FFMPEG 환경 변수 > PATH 의 ffmpeg > imageio-ffmpeg 에 포함된 ffmpeg 순서로 찾는다
+    ffmpeg_path = os.environ.get("FFMPEG") or shutil.which("ffmpeg")
+    if ffmpeg_path:
+        return ffmpeg_path
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        raise EnvironmentError("ffmpeg 를 찾을 수 없습니다. 환경 변수 'FFMPEG'를 설정하거나 ffmpeg 또는 imageio-ffmpeg 를 설치하세요.")
+
+class VideoWriter:
+    # 프레임을 raw RGB 로 ffmpeg 의 stdin 에 바로 넘긴다. 코덱은 출력 파일 확장자로 정한다
+    def __init__(self, output_filepath: str, frame_per_second: int):
+        extension = os.path.splitext(output_filepath)[1].lower()
+        if extension not in VIDEO_CODECS:
+            raise ValueError(f"지원하지 않는 동영상 형식입니다. ({extension})")
+        self.output_filepath = output_filepath
+        self.frame_per_second = frame_per_second
+        self.codec_options = VIDEO_CODECS[extension]
+        self.ffmpeg_path = get_ffmpeg_path()
+        self.process = None
+        self.log = None
+        self.size = None
+        self.num_frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _open(self, size: tuple) -> None:
+        self.size = size
+        command = [self.ffmpeg_path, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{size[0]}x{size[1]}', '-r', str(self.frame_per_second), '-i', '-',
+                   # yuv420p 는 가로/세로가 짝수여야 한다
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white',
+                   *self.codec_options, self.output_filepath]
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.log)
+        return None
+
+    def write(self, img: Image.Image) -> None:
+        if self.process is None:
+            self._open(img.size)
+        if img.size != self.size:
+            raise ValueError(f"모든 프레임의 크기가 같아야 합니다. ({self.size} != {img.size})")
+        try:
+            self.process.stdin.write(img.convert('RGB').tobytes())
+        except BrokenPipeError:
+            self.close()
+        self.num_frames += 1
+        return None
+
+    def close(self) -> None:
+        if self.process is None:
+            return None
+        if not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = self.process.wait()
+        self.log.seek(0)
+        log = self.log.read().decode(errors='replace')
+        self.log.close()
+        self.process = None
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg 가 동영상을 만들지 못했습니다. (returncode {returncode})\n{log}")
+        return None
+
+def get_writer(output_filepath: str, frame_per_second: int) -> Union[GifWriter, VideoWriter]:
+    # 출력 파일 확장자로 GIF/동영상 writer 를 고른다
+    extension = os.path.splitext(output_filepath)[1].lower()
+    if extension in VIDEO_CODECS:
+        return VideoWriter(output_filepath, frame_per_second)
+    return GifWriter(output_filepath, duration=set_duration(frame_per_second), loop=0, disposal=2)
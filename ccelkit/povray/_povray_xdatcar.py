@@ -0,0 +1,60 @@
+import os
+import itertools
+import numpy as np
+from ase import Atoms
+from ase.io import iread
+from ase.data import atomic_numbers
+from typing import Iterator, TextIO, Union
+
+def is_xdatcar(filepath: str) -> bool:
+    return os.path.basename(filepath).endswith('XDATCAR')
+
+def count_xdatcar_frames(filepath: str) -> int:
+    # Atoms 를 만들지 않고 configuration 줄만 센다
+    with open(filepath, 'r') as f:
+        return sum(1 for line in f if 'configuration=' in line)
+
+def parse_xdatcar(f: TextIO) -> Iterator[Atoms]:
+    # ase 의 read_vasp_xdatcar 와 같은 규칙으로 configuration 을 하나씩 읽는다. cell 이 바뀌는 XDATCAR 는 header 가 다시 나온다
+    cell, numbers = None, None
+    while True:
+        line = f.readline()
+        if not line:
+            return
+        if 'Direct configuration=' not in line:
+            try:
+                scale = float(f.readline())
+            except ValueError:
+                return
+            cell = np.array([[float(x) for x in f.readline().split()] for _ in range(3)]) * scale
+            species = f.readline().split()
+            counts = [int(n) for n in f.readline().split()]
+            numbers = np.repeat([atomic_numbers[symbol] for symbol in species], counts)
+            f.readline()
+        if numbers is None:
+            raise ValueError("XDATCAR 의 header 가 없습니다.")
+        rows = [f.readline().split()[:3] for _ in range(len(numbers))]
+        if any(len(row) < 3 for row in rows):
+            raise ValueError("XDATCAR 의 마지막 프레임이 완전하지 않습니다.")
+        atoms = Atoms(numbers=numbers, cell=cell, pbc=True)
+        atoms.set_scaled_positions(np.array(rows, dtype=float))
+        yield atoms
+
+def iread_xdatcar(filepath: str, index: Union[slice, int] = slice(None)) -> Iterator[Atoms]:
+    # ase 의 iread 는 XDATCAR 의 모든 프레임을 만든 뒤에 돌려주므로, 파일을 앞에서부터 읽으면서 index 의 프레임만 만든다
+    if isinstance(index, int):
+        index = slice(index, index + 1 or None)
+    start, stop, step = index.start, index.stop, index.step or 1
+    if step < 0:
+        # 역순은 앞에서부터 읽을 수 없다
+        yield from iread(filepath, index=index, format='vasp-xdatcar')
+        return
+    if (start is not None and start < 0) or (stop is not None and stop < 0):
+        start, stop, step = index.indices(count_xdatcar_frames(filepath))
+    with open(filepath, 'r') as f:
+        yield from itertools.islice(parse_xdatcar(f), start, stop, step)
+
+def iread_frames(filepath: str, index: Union[slice, int] = slice(None)) -> Iterator[Atoms]:
+    if is_xdatcar(filepath):
+        return iread_xdatcar(filepath, index)
+    return iread(filepath, index=index)
@@ -1,103 +1,209 @@
 import os
-from ase.io import read, write
-from PIL import Image
-import subprocess
-from ._povray_utils import set_repeatation
-from ._povray_utils import set_cell_off
-from ._povray_utils import set_canvas_width
-from ._povray_utils import set_transmittances
-from ._povray_utils import set_heatmaps
-from ._povray_utils import set_camera_orientation
-from ._povray_utils import set_custom_colors
-from ._povray_utils import parse_orientation
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from ase.io import read
+from functools import partial
+from ._povray_utils import parse_orientations
+from ._povray_utils import get_view_filepaths
 from ._povray_utils import create_config
-from ._povray_utils import set_position_smoothing
-from ._povray_utils import set_postfix
-from ._povray_utils import set_duration
+from ._povray_utils import find_target_files
+from ._povray_utils import parse_frames
+from ._povray_utils import skip_similar_frames
+from ._povray_utils import load_atom_values
+from ._povray_utils import get_value_range
+from ._povray_utils import set_frame_values
+from ._povray_render import RenderPlan, map_frames
+from ._povray_writer import get_writer, make_contact_sheet, VIDEO_CODECS
+from ._povray_xdatcar import iread_frames
+from ._povray_cache import get_render_cache_dir, get_scene_cache_dir, get_render_cache_max_bytes, evict_render_cache
 import yaml
-from typing import List,Dict,Union
+from typing import List,Dict,Union,Tuple,Iterable,Iterator
+from ase import Atoms
+from PIL import Image
 from tqdm import tqdm
 
+def get_render_plan(orientation: Union[str, List] = 'perspective'
+                    , repeatation: List[int] = [1,1,1]
+                    , cell_off: bool = False
+                    , transmittances: Union[List[float],None] = None
+                    , heatmaps: Union[List[float],None] = None
+                    , canvas_width: int = 1000
+                    , color_species: Union[Dict[str,List[float]],None] = None
+                    , color_index: Union[Dict[str,List[float]],None] = None
+                    , is_trajectory: bool = False
+                    , use_cache: bool = True
+                    , reuse_scene: bool = False
+                    , preview: bool = False
+                    , raster: bool = False
+                    , colormap: str = "redblue"
+                    , heatmap_range: Union[List[float], None] = None
+                    , cull: bool = False) -> Tuple[RenderPlan, List[str], Union[tempfile.TemporaryDirectory, None]]:
+    # orientation 은 하나 또는 여러 개의 방향. (RenderPlan, 방향 이름, 끝나면 지워야 하는 임시 장면 폴더) 를 돌려준다
+    views = parse_orientations(orientation)
+    view_names = [name for name, _ in views]
+    orientations = [matrix for _, matrix in views]
+
+    cache_dir = get_render_cache_dir() if use_cache else None
+    # reuse_scene: 원자 배치를 POV include 파일로 한 번만 쓰고, 카메라/색만 바뀌면 그대로 다시 사용한다
+    scene_dir = None
+    temp_scene_dir = None
+    if reuse_scene:
+        if use_cache:
+            scene_dir = get_scene_cache_dir()
+        else:
+            temp_scene_dir = tempfile.TemporaryDirectory(prefix='ccelkit_scene_')
+            scene_dir = temp_scene_dir.name
+
+    # 프레임마다 바뀌지 않는 설정은 RenderPlan 을 만들 때 한 번만 계산한다
+    plan = RenderPlan(repeatation=repeatation, orientations=orientations
+                      , cell_off=cell_off, transmittances=transmittances
+                      , heatmaps=heatmaps, canvas_width=canvas_width
+                      , color_species=color_species, color_index=color_index
+                      , is_trajectory=is_trajectory
+                      , cache_dir=cache_dir
+                      , scene_dir=scene_dir
+                      , preview=preview, raster=raster
+                      , colormap=colormap, heatmap_range=heatmap_range
+                      , cull=cull)
+    return plan, view_names, temp_scene_dir
+
+def evict_caches(reuse_scene: bool = False) -> None:
+    evict_render_cache(get_render_cache_dir(), get_render_cache_max_bytes())
+    if reuse_scene:
+        evict_render_cache(get_scene_cache_dir(), get_render_cache_max_bytes(), extensions=('.inc',))
+    return None
+
+def render_atoms(atoms: Atoms
+                 , orientation: Union[str, List] = 'perspective'
+                 , jobs: int = 1
+                 , heatmap_source: Union[str, None] = None
+                 , transmittance_source: Union[str, None] = None
+                 , use_cache: bool = False
+                 , reuse_scene: bool = False
+                 , **settings) -> Union[Image.Image, List[Image.Image]]:
+    # Atoms 하나를 렌더링해서 PIL 이미지로 돌려준다. orientation 이 여러 개이면 방향 순서대로 이미지의 list.
+    # settings 는 to_povray_image 와 같다 (repeatation, cell_off, transmittances, heatmaps, canvas_width, color_species,
+    # color_index, preview, raster, colormap, heatmap_range, cull). jobs 는 동시에 렌더링할 방향의 수.
+    # POV-Ray 는 호출마다 따로 만든 임시 폴더에서 실행되므로 여러 프로세스/스레드에서 동시에 불러도 된다
+    images, = render_frames([atoms], orientation, 1, heatmap_source, transmittance_source, use_cache, reuse_scene, view_jobs=jobs, **settings)
+    return images
+
+def render_frames(frames: Iterable[Atoms]
+                  , orientation: Union[str, List] = 'perspective'
+                  , jobs: int = 1
+                  , heatmap_source: Union[str, None] = None
+                  , transmittance_source: Union[str, None] = None
+                  , use_cache: bool = False
+                  , reuse_scene: bool = False
+                  , view_jobs: int = 1
+                  , **settings) -> Iterator[Union[Image.Image, List[Image.Image]]]:
+    # Atoms 의 iterable 을 순서대로 렌더링한다. jobs 개의 프로세스를 사용하고 frames 는 필요한 만큼만 읽는다.
+    # heatmap_source/transmittance_source 는 각 프레임의 원자별 값 이름 (forces, charges, ...) 또는 .npy 파일.
+    # 라이브러리에서는 호출이 많으므로 기본으로 렌더링 캐시를 쓰지 않는다
+    if jobs < 1:
+        jobs = os.cpu_count()
+    if view_jobs < 1:
+        view_jobs = os.cpu_count()
+    heatmap_values = load_atom_values(heatmap_source)
+    if settings.get('heatmap_range') is None:
+        settings['heatmap_range'] = get_value_range(heatmap_values)
+    plan, view_names, temp_scene_dir = get_render_plan(orientation, use_cache=use_cache, reuse_scene=reuse_scene, **settings)
+    frames = set_frame_values(frames, slice(None), heatmap_values, load_atom_values(transmittance_source))
+    try:
+        for images in map_frames(partial(plan, view_jobs=view_jobs), frames, jobs):
+            yield images[0] if len(view_names) == 1 else images
+    finally:
+        if temp_scene_dir is not None:
+            temp_scene_dir.cleanup()
+    if use_cache:
+        evict_caches(reuse_scene)
+    return None
+
 def to_povray_image(input_filepath: str
                     , output_filepath: str
                     , repeatation: List[int] = [1,1,1]
-                    , orientation: str = 'perspective'
+                    , orientation: Union[str, List] = 'perspective'
                     , cell_off: bool = False
                     , transmittances: Union[List[float],None] = None
                     , heatmaps: Union[List[float],None] = None
                     , canvas_width: int = 1000
                     , color_species: Union[Dict[str,List[float]],None] = None
                     , color_index: Union[Dict[str,List[float]],None] = None
-                    , frame_per_second: int = 24):
-    
-    orientation = parse_orientation(orientation)
+                    , frame_per_second: int = 24
+                    , jobs: int = 1
+                    , frames: Union[str, None] = None
+                    , rmsd_threshold: Union[float, None] = None
+                    , use_cache: bool = True
+                    , reuse_scene: bool = False
+                    , contact_sheet: bool = False
+                    , preview: bool = False
+                    , raster: bool = False
+                    , heatmap_source: Union[str, None] = None
+                    , transmittance_source: Union[str, None] = None
+                    , colormap: str = "redblue"
+                    , heatmap_range: Union[List[float], None] = None
+                    , cull: bool = False
+                    , evict_cache: bool = True):
     
     is_trajectory = input_filepath.endswith('XDATCAR') or input_filepath.endswith('.traj')
-    temp_images = []
-    
-    atoms_list = read(input_filepath, index=':') if is_trajectory else [read(input_filepath)]
-    
-    for i, atoms in enumerate(atoms_list):
-        atoms = set_position_smoothing(atoms)
-        atoms = set_repeatation(atoms, repeatation)
-        atoms = set_cell_off(atoms, cell_off)
-
-        # POV-Ray 설정
-        povray_settings = {}
-        if is_trajectory:
-            povray_settings['background'] = 'White'
-        set_canvas_width(povray_settings, canvas_width)
-        set_transmittances(povray_settings, transmittances)
-        set_heatmaps(povray_settings, heatmaps)
-        set_custom_colors(atoms, povray_settings, color_species, color_index)
-        rotation = set_camera_orientation(povray_settings, orientation)
+    # jobs 가 1 보다 작으면 모든 코어를 사용한다
+    if jobs < 1:
+        jobs = os.cpu_count()
 
-        povray_base_path = os.environ.get("POVRAY")
-        if not povray_base_path:
-            raise EnvironmentError("환경 변수 'POVRAY'가 설정되지 않았습니다.")
-        povray_include_path = os.path.join(povray_base_path, "include")
+    # 프레임별 heatmap/투명도. .npy 는 memory map 으로 열어 두고 프레임마다 한 행씩 읽는다
+    heatmap_values = load_atom_values(heatmap_source)
+    transmittance_values = load_atom_values(transmittance_source)
+    if heatmap_range is None:
+        heatmap_range = get_value_range(heatmap_values)
 
-        write('./temp.pov', atoms, rotation=rotation, povray_settings=povray_settings)
-        with open('./temp.ini', 'a') as file:
-            file.write(f'Library_Path="{povray_include_path}"\n')
+    # orientation 이 여러 개이면 방향마다 이름을 붙인 파일로 저장한다
+    render, view_names, temp_scene_dir = get_render_plan(orientation, repeatation, cell_off, transmittances, heatmaps, canvas_width
+                                                         , color_species, color_index, is_trajectory, use_cache, reuse_scene
+                                                         , preview, raster, colormap, heatmap_range, cull)
 
-        povray_command = ['povray', '-D', f'+L{povray_include_path}', "./temp.pov", 'temp.ini']
-        with subprocess.Popen(povray_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as process:
-            process.wait()
-
-        if is_trajectory:
-            img = Image.open('./temp.png')
-            new_img = Image.new('RGBA', img.size, (255, 255, 255, 0))
-            new_img.paste(img, (0, 0))
-            temp_images.append(new_img)
-            img.close()
+    try:
+        if not is_trajectory:
+            # 구조 하나는 여러 방향을 동시에 렌더링한다
+            # read 는 마지막 프레임을 읽으므로 (프레임 x 원자) 배열도 마지막 행을 사용한다
+            atoms = next(set_frame_values([read(input_filepath)], -1, heatmap_values, transmittance_values))
+            images = render(atoms, view_jobs=jobs)
+            for img, view_filepath in zip(images, get_view_filepaths(output_filepath, view_names)):
+                img.save(view_filepath)
+            if contact_sheet and len(images) > 1:
+                make_contact_sheet(images).save(output_filepath)
+            for img in images:
+                img.close()
         else:
-            img = Image.open('./temp.png')
-            img.save(output_filepath)
-            img.close()
-
-        os.remove("./temp.ini")
-        os.remove("./temp.pov")
-        os.remove("./temp.png")
-
-    if is_trajectory and temp_images:
-        try:
-            if not output_filepath.endswith('.gif'):
+            # 궤적은 한 프레임씩 읽어서 렌더링하는 즉시 GIF 에 기록한다
+            index = parse_frames(frames)
+            atoms_iter = iread_frames(input_filepath, index)
+            atoms_iter = set_frame_values(atoms_iter, index, heatmap_values, transmittance_values)
+            atoms_iter = skip_similar_frames(atoms_iter, rmsd_threshold)
+            # 동영상 확장자(.mp4, .webm 등)가 아니면 GIF 로 저장한다
+            extension = os.path.splitext(output_filepath)[1].lower()
+            if extension != '.gif' and extension not in VIDEO_CODECS:
                 output_filepath = os.path.splitext(output_filepath)[0] + '.gif'
-                
-            temp_images = [img.convert('RGB') for img in temp_images]
-            temp_images[0].save(
-                output_filepath,
-                save_all=True,
-                append_images=temp_images[1:],
-                duration=set_duration(frame_per_second),
-                loop=0,
-                disposal=2
-            )
-        finally:
-            for img in temp_images:
-                img.close()
+            with ExitStack() as stack:
+                writers = [stack.enter_context(get_writer(view_filepath, frame_per_second))
+                           for view_filepath in get_view_filepaths(output_filepath, view_names)]
+                sheet_writer = None
+                if contact_sheet and len(view_names) > 1:
+                    sheet_writer = stack.enter_context(get_writer(output_filepath, frame_per_second))
+                for images in map_frames(render, atoms_iter, jobs):
+                    for writer, img in zip(writers, images):
+                        writer.write(img)
+                    if sheet_writer is not None:
+                        sheet_writer.write(make_contact_sheet(images))
+                    for img in images:
+                        img.close()
+    finally:
+        if temp_scene_dir is not None:
+            temp_scene_dir.cleanup()
 
+    # 캐시 폴더 전체를 읽어야 하므로 여러 파일을 렌더링할 때는 호출한 쪽에서 마지막에 한 번만 정리한다
+    if use_cache and evict_cache:
+        evict_caches(reuse_scene)
     return None
     
 def visual(args):
@@ -117,6 +223,23 @@ def visual(args):
         color_index = config['color_index']
         frame_per_second = config['frame_per_second']
         postfix = config['postfix']
+        jobs = config.get('jobs', 1)
+        frames = config.get('frames')
+        rmsd_threshold = config.get('rmsd_threshold')
+        use_cache = config.get('cache', True)
+        reuse_scene = config.get('reuse_scene', False)
+        contact_sheet = config.get('contact_sheet', False)
+        preview = config.get('preview', False)
+        raster = config.get('raster', False)
+        heatmap_source = config.get('heatmap_source')
+        transmittance_source = config.get('transmittance_source')
+        colormap = config.get('colormap', 'redblue')
+        heatmap_range = config.get('heatmap_range')
+        cull = config.get('cull', False)
+        workers = config.get('workers', 1)
+        max_depth = config.get('max_depth')
+        include = config.get('include')
+        exclude = config.get('exclude')
     else:
         target: str = args.target
         config: str = args.config
@@ -132,25 +255,32 @@ def visual(args):
         color_index: Dict[str,List[float]] = args.color_index
         frame_per_second: int = args.frame_per_second
         postfix: str = args.postfix
+        jobs: int = getattr(args, 'jobs', 1)
+        frames: str = getattr(args, 'frames', None)
+        rmsd_threshold: float = getattr(args, 'rmsd_threshold', None)
+        use_cache: bool = not getattr(args, 'no_cache', False)
+        reuse_scene: bool = getattr(args, 'reuse_scene', False)
+        contact_sheet: bool = getattr(args, 'contact_sheet', False)
+        preview: bool = getattr(args, 'preview', False)
+        raster: bool = getattr(args, 'raster', False)
+        heatmap_source: str = getattr(args, 'heatmap_source', None)
+        transmittance_source: str = getattr(args, 'transmittance_source', None)
+        colormap: str = getattr(args, 'colormap', 'redblue')
+        heatmap_range: List[float] = getattr(args, 'heatmap_range', None)
+        cull: bool = getattr(args, 'cull', False)
+        workers: int = getattr(args, 'workers', 1)
+        max_depth: int = getattr(args, 'max_depth', None)
+        include: List[str] = getattr(args, 'include', None)
+        exclude: List[str] = getattr(args, 'exclude', None)
 
     files_to_be_processed = []
     files_to_be_saved = []
     if target:
         if (input_filepath or output_filepath):
             raise ValueError("input_filepath and output_filepath cannot be specified when target is specified")
-        for root, _, files in os.walk('.'):
-            for file in files:
-                if target in file and not file.startswith('img_'):
-                    file_path = os.path.abspath(os.path.join(root, file))
-                    files_to_be_processed.append(file_path)
-
-                    if '.' in file:
-                        file_name, _ = os.path.splitext(file)
-                    else:
-                        file_name = file
-                    new_file_name = set_postfix(file_name + postfix)
-                    new_file_path = os.path.abspath(os.path.join(root, new_file_name))
-                    files_to_be_saved.append(new_file_path)
+        for file_path, new_file_path in find_target_files(target, postfix, '.', max_depth, include, exclude):
+            files_to_be_processed.append(file_path)
+            files_to_be_saved.append(new_file_path)
     else:
         files_to_be_processed.append(input_filepath)
         files_to_be_saved.append(output_filepath)
@@ -159,15 +289,35 @@ def visual(args):
                          'img_' + os.path.basename(path) if not os.path.basename(path).startswith('img_') else os.path.basename(path))
                          for path in files_to_be_saved]
 
-    
-    for input_filepath, output_filepath in tqdm(zip(files_to_be_processed, files_to_be_saved), 
-                                              desc="이미지 생성 중", 
-                                              total=len(files_to_be_processed),
-                                              unit="개"):
-        print(f"{input_filepath} -> {output_filepath}")
-        to_povray_image(input_filepath, output_filepath
-                        , repeatation, orientation
-                        , cell_off, transmittances
-                        , heatmaps, canvas_width
-                        , color_species, color_index
-                        , frame_per_second)
+    render = partial(to_povray_image
+                     , repeatation=repeatation, orientation=orientation
+                     , cell_off=cell_off, transmittances=transmittances
+                     , heatmaps=heatmaps, canvas_width=canvas_width
+                     , color_species=color_species, color_index=color_index
+                     , frame_per_second=frame_per_second, jobs=jobs
+                     , frames=frames, rmsd_threshold=rmsd_threshold
+                     , use_cache=use_cache, reuse_scene=reuse_scene
+                     , contact_sheet=contact_sheet
+                     , preview=preview, raster=raster
+                     , heatmap_source=heatmap_source, transmittance_source=transmittance_source
+                     , colormap=colormap, heatmap_range=heatmap_range
+                     , cull=cull, evict_cache=False)
+
+    if workers < 1:
+        workers = os.cpu_count()
+    tasks = list(zip(files_to_be_processed, files_to_be_saved))
+    if workers > 1 and len(tasks) > 1:
+        # 파일마다 따로 만든 임시 폴더에서 POV-Ray 를 실행하므로 여러 파일을 동시에 렌더링할 수 있다
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            futures = {executor.submit(render, input_filepath, output_filepath): (input_filepath, output_filepath)
+                       for input_filepath, output_filepath in tasks}
+            for future in tqdm(as_completed(futures), desc="이미지 생성 중", total=len(tasks), unit="개"):
+                future.result()
+                input_filepath, output_filepath = futures[future]
+                tqdm.write(f"{input_filepath} -> {output_filepath}")
+    else:
+        for input_filepath, output_filepath in tqdm(tasks, desc="이미지 생성 중", total=len(tasks), unit="개"):
+            print(f"{input_filepath} -> {output_filepath}")
+            render(input_filepath, output_filepath)
+    if use_cache:
+        evict_caches(reuse_scene)
@@ -3,6 +3,12 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
 sys.path.insert(0, project_root)
 
 from povray import visual
+from povray._povray_scene import get_view
+from ase.io import read
+from ase.io.pov import POVRAY
+from ase.io.utils import PlottingVariables
+from ase.data import covalent_radii
+from ase.utils import rotate
 import argparse
 import numpy as np
 import inspect
@@ -221,6 +227,19 @@ def test_config():
     args = argparse.Namespace(**default_settings)
     visual(args)
 
+def test_scene_view():
+    # reuse_scene/raster/cull 은 ase 의 화면 배치를 따라 계산한다. ase 의 배치 방법이 바뀌면 여기서 실패한다
+    atoms = read("./src/perovskite_POSCAR").repeat(2)
+    radii = covalent_radii[atoms.numbers]
+    for rotation in ['0x,0y,0z', '-70x,-20y,10z', '90x,45y,0z']:
+        rotation_matrix = rotate(rotation)
+        plotting_variables = PlottingVariables(atoms, rotation=rotation_matrix, show_unit_cell=2, radii=radii, scale=1)
+        povray = POVRAY.from_PlottingVariables(plotting_variables)
+        view = get_view(atoms, radii, rotation_matrix)
+        positions = view['scale'] * atoms.get_positions() @ rotation_matrix + view['translation']
+        assert np.allclose(positions, povray.positions[:len(atoms)], atol=1e-9), rotation
+        assert np.isclose(view['width'], povray.image_width) and np.isclose(view['height'], povray.image_height), rotation
+
 def main():
     # test_default_settings()
     # test_repeatation()
@@ -232,6 +251,7 @@ def main():
     # test_config()
     # test_orientation()
     # test_target()
+    test_scene_view()
     test_gif()
 
 
@@ -11,12 +11,16 @@ setup(
         "pyyaml",
         "numpy",
     ],
+    extras_require={
+        "video": ["imageio-ffmpeg"],
+        "colormap": ["matplotlib>=3.5"],
+    },
     entry_points={
         'console_scripts': [
             'ccelkit=ccelkit.cli:main',
         ],
     },
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     author="CCEL",
     author_email="snupark@snu.ac.kr",
     description="원자 구조 시각화를 위한 POV-Ray 기반 도구",